@@ -1,5 +1,7 @@
 import streamlit as st
 import pandas as pd
+import altair as alt
+import numpy as np
 import random
 import os
 # from io import BytesIO
@@ -9,15 +11,23 @@ import math
 import unicodedata
 import re
 import uuid
+import hashlib
+import heapq
+import threading
+import time
 from datetime import date
 
 import json
+import sqlite3
 import io
+import zipfile
+import tempfile
+import google_auth_httplib2
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
+from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload, build_http
 
-from PIL import Image
+from PIL import Image, features
 
 button_css1 = f"""
     <style>
@@ -35,26 +45,52 @@ button_css1 = f"""
     """
 st.markdown(button_css1, unsafe_allow_html=True)
 
-def init():
-    # json認証
-    if "service" not in st.session_state:
-            # Secret から JSON を取得
-        json_str = st.secrets["GCP_SERVICE_ACCOUNT_JSON"]
-
-        # 一時ファイルとして保存
-        with open("service-account.json", "w") as f:
-            f.write(json_str)
-
-        # 認証スコープ（DriveとSheetsを両方使えるように）
-        SCOPES = ["https://www.googleapis.com/auth/drive"]
-
-        # JSONファイルを使って認証
-        creds = service_account.Credentials.from_service_account_file(
-        "service-account.json", scopes=SCOPES
-        )
-
-        st.session_state.service = build("drive", "v3", credentials=creds)  
+# 認証スコープ（DriveとSheetsを両方使えるように）
+DRIVE_SCOPES = ["https://www.googleapis.com/auth/drive"]
+
+# 貸し出していない接続を残しておく数
+DRIVE_HTTP_POOL_SIZE = 8
+
+# Google Driveへの接続のプール（全セッションで共有）
+# httplib2はスレッドセーフではないので、リクエストごとに接続を1つ借りて使い終わったら返す
+# （トークンの更新はAuthorizedHttpが行う。接続はbuild_httpで作り、タイムアウトを付ける）
+class DriveHttpPool:
+    def __init__(self, creds, size=DRIVE_HTTP_POOL_SIZE):
+        self.creds = creds
+        self.size = size
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def request(self, *args, **kwargs):
+        with self.lock:
+            http = self.idle.pop() if self.idle else None
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(self.creds, http=build_http())
+        try:
+            return http.request(*args, **kwargs)
+        finally:
+            with self.lock:
+                if len(self.idle) < self.size:
+                    self.idle.append(http)
+                    http = None
+            if http is not None:
+                http.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for http in idle:
+            http.close()
+
+# Google Driveのクライアント（全セッションで共有）
+# 認証情報はSecretから直接読み込み、ファイルには書き出さない
+@st.cache_resource
+def get_drive_service():
+    info = json.loads(st.secrets["GCP_SERVICE_ACCOUNT_JSON"])
+    creds = service_account.Credentials.from_service_account_info(info, scopes=DRIVE_SCOPES)
+    return build("drive", "v3", http=DriveHttpPool(creds), cache_discovery=False)
 
+def init():
     # sidebarのselectboxのpage_idを有効にするフラグ
     if "page_id_flag" not in st.session_state:
         st.session_state.page_id_flag = True
@@ -69,12 +105,11 @@ def init():
 
     # 結合前の一時的なcreate_df
     if "create_df_temp" not in st.session_state:
-        columns = ["🔴赤", "🔵青", "🟡黄", "🟢緑", "🟣紫"]
-        st.session_state.create_df_temp = pd.DataFrame(columns=columns)
+        st.session_state.create_df_temp = DeckColumns(COLOR_COLUMNS.values())
 
-    if "player_df" not in st.session_state:
-        # st.session_state.player_df = pd.read_csv("player/player.csv")
-        st.session_state.player_df = load_csv_from_cloud()
+    if "players" not in st.session_state:
+        # st.session_state.players = PlayerStore.from_df(pd.read_csv("player/player.csv"))
+        st.session_state.players = get_shared_players()
 
     if "image_name" not in st.session_state:
         st.session_state.image_name = None
@@ -85,6 +120,13 @@ def init():
     if "transition_flag" not in st.session_state:
         st.session_state.transition_flag = False
 
+    # 抽出のシードを作るセッションごとの乱数と、抽出の記録
+    if "draw_rng" not in st.session_state:
+        st.session_state.draw_rng = random.Random()
+
+    if "draw_log" not in st.session_state:
+        st.session_state.draw_log = []
+
     if "output_decks" not in st.session_state:
         st.session_state.output_decks = []
 
@@ -94,45 +136,13 @@ def init():
     if "player_num_default" not in st.session_state:
         st.session_state.player_num_default = 1
 
+    # 全デッキの一覧（色別・Tier別）はプロセス共通のカタログから取得
     if "create_df_temp2" not in st.session_state:
-        columns = ["🔴赤", "🔵青", "🟡黄", "🟢緑", "🟣紫"]
-        create_df_temp2 = pd.DataFrame(columns=columns)
-        # 赤のpngファイル名を全て抽出
-        png_files1 = list_png_files("image/赤")
-        for file1 in png_files1:
-            target_value1 = file1.replace(".png", "")
-            create_df_temp2 = save_image_names_to_df(create_df_temp2,"🔴赤",target_value1)
-
-        # 青のpngファイル名を全て抽出
-        png_files2 = list_png_files("image/青")
-        for file2 in png_files2:
-            target_value2 = file2.replace(".png", "")
-            create_df_temp2 = save_image_names_to_df(create_df_temp2,"🔵青",target_value2)
-
-        # 緑のpngファイル名を全て抽出
-        png_files3 = list_png_files("image/緑")
-        for file3 in png_files3:
-            target_value3 = file3.replace(".png", "")
-            create_df_temp2 = save_image_names_to_df(create_df_temp2,"🟢緑",target_value3)
-
-        # 黄のpngファイル名を全て抽出
-        png_files4 = list_png_files("image/黄")
-        for file4 in png_files4:
-            target_value4 = file4.replace(".png", "")
-            create_df_temp2 = save_image_names_to_df(create_df_temp2,"🟡黄",target_value4)
-
-        # 紫のpngファイル名を全て抽出
-        png_files5 = list_png_files("image/紫")
-        for file5 in png_files5:
-            target_value5 = file5.replace(".png", "")
-            create_df_temp2 = save_image_names_to_df(create_df_temp2,"🟣紫",target_value5)
-
-        # 保存 & 表示
-        st.session_state.create_df_temp2 = sort_df(create_df_temp2)
+        st.session_state.create_df_temp2 = get_deck_catalog()["color_df"].copy()
 
     # Tier別dfを作成
     if "Tier_df" not in st.session_state:
-        st.session_state.Tier_df = df_to_tier_df(st.session_state.create_df_temp2)
+        st.session_state.Tier_df = get_deck_catalog()["tier_df"].copy()
 
     # if "q2" not in st.session_state:
     #     st.session_state.q1, st.session_state.q2, st.session_state.q3 = get_tier_quantiles(st.session_state.Tier_df)
@@ -152,12 +162,18 @@ def normalize_dataframe(df):
         df_copy[col] = df_copy[col].apply(lambda x: normalize_text(x) if pd.notna(x) else x)
     return df_copy
 
+# デッキの色（画像フォルダ・Tier_Listのファイル名）→ デッキリストの列名
+# 色を増やすときはここだけ変える。並びは表示の順で、同名のデッキはこの順で先の色を優先する
+COLOR_COLUMNS = {"赤": "🔴赤", "青": "🔵青", "黄": "🟡黄", "緑": "🟢緑", "紫": "🟣紫"}
+# Tierの段階（Tier_Listの値）と、Tierごとのデッキリストの列名
+TIER_LEVELS = [1.0, 1.5, 2.0, 2.5, 3.0, 4.0, 5.0]
+TIER_COLUMNS = [f"Tier{tier}" for tier in TIER_LEVELS]
+
 def normalize_filename(filename):
     return unicodedata.normalize('NFKC', filename)
 
 def normalize_image_filenames(image_root="image"):
-    color_folders = ["赤", "青", "緑", "黄", "紫"]
-    for color in color_folders:
+    for color in COLOR_COLUMNS:
         folder_path = os.path.join(image_root, color)
         if not os.path.exists(folder_path):
             continue
@@ -178,9 +194,53 @@ def normalize_image_filenames(image_root="image"):
                 # ② 正規化された名前にリネーム
                 os.rename(temp_path, new_path)
 
+# 画像ファイル名の正規化済みマーカー（正規化の方法を変えたらバージョンを上げる）
+IMAGE_NORMALIZE_MARKER = "cache/image_normalized.json"
+IMAGE_NORMALIZE_VERSION = 1
+
+# 色フォルダの更新時刻（ファイルの追加・削除・リネームで変わる）
+def image_dir_mtimes(image_root="image", color_folders=tuple(COLOR_COLUMNS)):
+    mtimes = []
+    for color in color_folders:
+        try:
+            mtimes.append(os.path.getmtime(os.path.join(image_root, color)))
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+@st.cache_resource
+def image_normalize_store():
+    return {"lock": threading.Lock(), "mtimes": None}
+
+# 画像フォルダが変わったときだけファイル名を正規化する
+# フォルダの状態がマーカーと一致していればフォルダ内は走査しない
+def ensure_image_filenames_normalized(image_root="image", marker_path=IMAGE_NORMALIZE_MARKER):
+    store = image_normalize_store()
+    mtimes = image_dir_mtimes(image_root)
+    if mtimes == store["mtimes"]:
+        return
+
+    with store["lock"]:
+        try:
+            with open(marker_path, encoding="utf-8") as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            marker = None
+
+        if marker != {"version": IMAGE_NORMALIZE_VERSION, "image_dirs": mtimes}:
+            normalize_image_filenames(image_root)
+            mtimes = image_dir_mtimes(image_root)
+            marker = {"version": IMAGE_NORMALIZE_VERSION, "image_dirs": mtimes}
+            try:
+                write_file_atomic(marker_path, json.dumps(marker))
+            except OSError as e:
+                print(f"正規化マーカーの保存に失敗しました: {e}")
+
+        store["mtimes"] = mtimes
+
 # --- 🔽 各列をあいうえお順に並べ替え ---
 # 各列をソートしてから、NaNで埋めて長さを揃える
-def sort_df(df, columns = ["🔴赤", "🔵青", "🟡黄", "🟢緑", "🟣紫"]):
+def sort_df(df, columns = list(COLOR_COLUMNS.values())):
     
     sort_df = pd.DataFrame(columns=columns)
 
@@ -200,6 +260,60 @@ def sort_df(df, columns = ["🔴赤", "🔵青", "🟡黄", "🟢緑", "🟣紫"
 
     return sorted_df
 
+# 列ごとのデッキ名（色別・Tier別のデッキリスト）
+# 列ごとのリストと重複確認用のsetで保持し、表示・保存するときだけDataFrameにする
+class DeckColumns:
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.values = {col: [] for col in self.columns}
+        self.seen = {col: set() for col in self.columns}
+
+    @classmethod
+    def from_df(cls, df):
+        deck_columns = cls(df.columns)
+        for col in df.columns:
+            deck_columns.extend(col, df[col].dropna())
+        return deck_columns
+
+    # デッキ名を列に追加する（すでに存在する場合はFalse）
+    def add(self, column, image_name):
+        if column not in self.values:
+            self.columns.append(column)
+            self.values[column] = []
+            self.seen[column] = set()
+
+        deck_name = str(image_name).replace(".png", "")
+        if deck_name in self.seen[column]:
+            return False
+
+        self.seen[column].add(deck_name)
+        self.values[column].append(deck_name)
+        return True
+
+    # まとめて追加し、すでに存在していたデッキ名のリストを返す
+    def extend(self, column, image_names):
+        return [image_name for image_name in image_names if not self.add(column, image_name)]
+
+    def is_empty(self):
+        return not any(self.values.values())
+
+    # 列の長さをNoneで揃えてDataFrameにする
+    def to_df(self, sort=False):
+        values = {col: sorted(self.values[col]) if sort else self.values[col] for col in self.columns}
+        max_len = max((len(vals) for vals in values.values()), default=0)
+        return pd.DataFrame(
+            {col: vals + [None] * (max_len - len(vals)) for col, vals in values.items()},
+            columns=self.columns,
+        )
+
+# キー（色・Tierなど）ごとにデッキ名をまとめ、列ごとにソートしたdfを作成
+def group_decks_to_df(keys, decks, columns):
+    deck_columns = DeckColumns(columns)
+    for key, deck in zip(keys, decks):
+        if key in deck_columns.values:
+            deck_columns.add(key, deck)
+    return deck_columns.to_df(sort=True)
+
 #  指定されたフォルダ内のすべての.pngファイル名をリストで返す関数。    
 def list_png_files(folder_path):
     try:
@@ -245,9 +359,84 @@ def list_png_files(folder_path):
 
 #     return os.path.join(folder_path, selected_csv)
 
+# Google Driveからダウンロードしたファイルのキャッシュ
+DRIVE_CACHE_DIR = "cache/drive"
+# この秒数以内に確認したファイルはメタデータの確認も省略する
+DRIVE_REVALIDATE_INTERVAL = 30.0
+
+@st.cache_resource
+def drive_cache_store():
+    return {"lock": threading.Lock(), "files": {}}
+
+# ファイルのバージョン（md5Checksum、なければmodifiedTime）
+def drive_file_version(meta):
+    return meta.get("md5Checksum") or meta.get("modifiedTime")
+
+# Google Driveのファイルをローカルキャッシュ経由で取得し、(パス, バージョン)を返す
+# md5Checksum（なければmodifiedTime）が変わっていなければダウンロードしない
+def fetch_drive_file(drive_service, file_id, cache_dir=DRIVE_CACHE_DIR):
+    store = drive_cache_store()
+    cached = store["files"].get(file_id)
+    now = time.monotonic()
+    if cached is not None and now - cached["checked_at"] < DRIVE_REVALIDATE_INTERVAL:
+        return cached["path"], cached["version"]
+
+    meta = drive_service.files().get(fileId=file_id, fields="id, modifiedTime, md5Checksum").execute()
+    version = drive_file_version(meta)
+    version_key = hashlib.sha1(version.encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(cache_dir, f"{file_id}_{version_key}")
+
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        # ダウンロードはロックの外で一時ファイルに行う（遅いファイルが他のセッションを止めないように）
+        # メモリに溜めずにファイルへ直接書き込む
+        try:
+            with open(temp_path, "wb") as fh:
+                downloader = MediaIoBaseDownload(fh, drive_service.files().get_media(fileId=file_id))
+                done = False
+                while not done:
+                    _, done = downloader.next_chunk()
+        except Exception:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    with store["lock"]:
+        if os.path.exists(temp_path):
+            os.replace(temp_path, path)
+        # ダウンロード中に他のセッションが新しい版を確認していたら、そちらを残す
+        current = store["files"].get(file_id)
+        if current is not None and current["checked_at"] > now:
+            return path, version
+        store["files"][file_id] = {"path": path, "version": version, "checked_at": now}
+        # 古いバージョンのキャッシュは削除（ダウンロード中の一時ファイルは残す）
+        for old_file in os.listdir(cache_dir):
+            if old_file.startswith(f"{file_id}_") and old_file != os.path.basename(path) and not old_file.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(cache_dir, old_file))
+                except OSError:
+                    pass
+    return path, version
+
+# 手元で更新したファイルは次回必ず再確認する
+def invalidate_drive_file(file_id):
+    drive_cache_store()["files"].pop(file_id, None)
+
+# キャッシュしたcsvファイルを読み込む（同じバージョンは全セッションで読み込み結果を共有）
+@st.cache_data(max_entries=32)
+def read_cached_csv(path, version):
+    return pd.read_csv(path)
+
+def read_drive_csv(drive_service, file_id):
+    path, version = fetch_drive_file(drive_service, file_id)
+    return read_cached_csv(path, version)
+
 def select_csv_from_list_folder(n=0):
     FOLDER_ID = "1drE8CfWp2f82aqCGNKFaRfe9y5Cvyhr4"  # ← あなたのフォルダIDに変更
-    drive_service = st.session_state.service
+    drive_service = get_drive_service()
 
     # === Google Driveのフォルダ一覧を最初の1回だけ取得 ===
     if "drive_csv_files" not in st.session_state:
@@ -291,15 +480,7 @@ def select_csv_from_list_folder(n=0):
     file_id = [f["id"] for f in files if f["name"] == selected_csv][0]
 
     try:
-        request = drive_service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
-        fh.seek(0)
-
-        df = pd.read_csv(fh)
+        df = read_drive_csv(drive_service, file_id)
     except Exception as e:
         st.error(f"CSVファイルの読み込みに失敗しました: {e}")
         return None
@@ -334,43 +515,28 @@ def extract_elements_by_title(df, target_title):
 
 # dfをTierで並べ替え
 def df_to_tier_df(df):
-    # Tier の分類リスト（必要に応じて変更）
-    tier_list = ["Tier1.0", "Tier1.5", "Tier2.0", "Tier2.5", "Tier3.0", "Tier4.0", "Tier5.0"]
-    tier_df = pd.DataFrame(columns=tier_list)
+    tier_list = TIER_COLUMNS
 
-    for col in df.columns:
-        for val in df[col]:
-            if pd.notna(val):
-                tier_num = Tier_of_Deck(val)
-                tier = "Tier" + str(tier_num)
-                if tier in tier_list:
-                    tier_df = save_image_names_to_df(tier_df, tier, val)
-                else:
-                    st.warning(f"Tierが無効または未定義です: {val} → {tier}")
+    decks = pd.Series(deck_names_of_df(df), dtype=object)
+    tiers = "Tier" + tiers_of_decks(decks).astype(str)
+
+    is_valid = tiers.isin(tier_list)
+    for val, tier in zip(decks[~is_valid], tiers[~is_valid]):
+        st.warning(f"Tierが無効または未定義です: {val} → {tier}")
 
-    tier_df = sort_df(tier_df, tier_list)
+    tier_df = group_decks_to_df(tiers[is_valid], decks[is_valid], tier_list)
 
     return tier_df
 # 各Tierの数と四分位数を計算
 def get_tier_quantiles(df):
-    tier_values = []
+    tier_values = tiers_of_decks(deck_names_of_df(df)).dropna()
 
-    # df のすべての値に対して Tier を取得してリスト化
-    for col in df.columns:
-        for val in df[col]:
-            if pd.notna(val):
-                try:
-                    tier = Tier_of_Deck(val)
-                    tier_values.append(tier)
-                except Exception as e:
-                    st.warning(f"{val} の Tier 判定中にエラー: {e}")
-
-    if not tier_values:
+    if tier_values.empty:
         st.error("Tier 値が見つかりませんでした。")
         return None
 
     # 四分位数の計算
-    tier_array = np.array(tier_values)
+    tier_array = tier_values.to_numpy()
     q1 = np.quantile(tier_array, 0.25)
     q2 = np.quantile(tier_array, 0.5)  # 中央
     q3 = np.quantile(tier_array, 0.75)
@@ -379,15 +545,7 @@ def get_tier_quantiles(df):
 # 全デッキから平均Tierを計算
 def calculate_average_tier(tier_df):
     # Tier名と対応する数値
-    tier_weights = {
-        "Tier1.0": 1.0,
-        "Tier1.5": 1.5,
-        "Tier2.0": 2.0,
-        "Tier2.5": 2.5,
-        "Tier3.0": 3.0,
-        "Tier4.0": 4.0,
-        "Tier5.0": 5.0
-    }
+    tier_weights = dict(zip(TIER_COLUMNS, TIER_LEVELS))
 
     total_tier = 0
     total_count = 0
@@ -403,17 +561,215 @@ def calculate_average_tier(tier_df):
     else:
         avg_tier = total_tier / total_count
         return round(avg_tier, 2)
-# dfからランダムに1要素を抽出
-def get_random(df):
-    # ランダムに1つのセル（要素）を取得（値がNoneでないもの）
-    while True:
-        row_idx = random.randint(0, len(df) - 1)
-        col_idx = random.randint(0, len(df.columns) - 1)
-        random_value = df.iat[row_idx, col_idx]
-        if pd.notna(random_value):  # 選択された要素は NaN ではない
-            break
-        
-    return random_value
+# デッキリストのdfから抽出対象のデッキを平らなリストにする（NaNと重複を除く）
+# 所持デッキと比べられるように、デッキ名は正規化してから重複を除く
+def deck_pool(df):
+    return list(dict.fromkeys(normalize_deck_name(name) for name in deck_names_of_df(df)))
+
+# プールからk個を重複なしで抽出する（excludeのデッキは除く）
+# 候補が足りなければValueError
+def sample_decks(pool, k, exclude=(), rng=random):
+    exclude = set(exclude)
+    candidates = [deck for deck in pool if deck not in exclude]
+    if len(candidates) < k:
+        raise ValueError(f"抽出できるデッキが足りません（候補 {len(candidates)} 個 / 必要 {k} 個）")
+    return rng.sample(candidates, k)
+
+# 均一ルールの基準（「全デッキの平均Tier」以外はその値を目標の平均にする）
+UNIFORM_TARGETS = ["全デッキの平均Tier", "2.0", "3.0", "4.0"]
+
+def uniform_target(style):
+    if style == UNIFORM_TARGETS[0]:
+        return st.session_state.avg_tier
+    return float(style)
+
+# Tierごとにデッキを分けた抽出用のバケツ（Tier不明のデッキは均一ルールでは使わない）
+class TierBuckets:
+    def __init__(self, pool, exclude=()):
+        exclude = set(exclude)
+        self.buckets = {}
+        for deck, tier in zip(pool, tiers_of_decks(pool)):
+            if deck not in exclude and pd.notna(tier):
+                self.buckets.setdefault(float(tier), []).append(deck)
+        self.tiers = sorted(self.buckets)
+
+    # 条件に合うTierのデッキから1個を均等に選んで取り出す
+    def pop(self, tiers, rng=random):
+        sizes = [len(self.buckets[tier]) for tier in tiers]
+        total = sum(sizes)
+        if total == 0:
+            return None, None
+        r = rng.randrange(total)
+        for tier, size in zip(tiers, sizes):
+            if r < size:
+                break
+            r -= size
+        bucket = self.buckets[tier]
+        # 末尾と入れ替えて取り出す
+        bucket[r], bucket[-1] = bucket[-1], bucket[r]
+        return bucket.pop(), tier
+
+    def nearest(self, target):
+        available = [tier for tier in self.tiers if self.buckets[tier]]
+        if not available:
+            return []
+        return [min(available, key=lambda tier: abs(tier - target))]
+
+# プレイヤーに渡すデッキをk個抽出する（所持デッキとは重複しない）
+# targetを指定すると均一ルール：所持デッキと抽出済みデッキの平均Tierが目標より低ければ目標より高いTierから、
+# 高ければ低いTierから選ぶ。該当するデッキがなければ目標に最も近いTierから選ぶ
+def draw_player_decks(pool, k, player_decks, target=None, rng=random):
+    owned = [normalize_deck_name(deck) for deck in player_decks]
+    if target is None:
+        return sample_decks(pool, k, exclude=owned, rng=rng)
+
+    buckets = TierBuckets(pool, exclude=owned)
+    owned_tiers = tiers_of_decks(owned).dropna()
+    tier_sum = float(owned_tiers.sum())
+    tier_count = len(owned_tiers)
+    drawn = []
+    for _ in range(k):
+        if tier_count == 0:
+            tiers = buckets.tiers
+        elif tier_sum / tier_count < target:
+            tiers = [tier for tier in buckets.tiers if tier > target]
+        elif tier_sum / tier_count > target:
+            tiers = [tier for tier in buckets.tiers if tier < target]
+        else:
+            tiers = [tier for tier in buckets.tiers if tier == target]
+
+        deck, tier = buckets.pop(tiers, rng)
+        if deck is None:
+            deck, tier = buckets.pop(buckets.nearest(target), rng)
+        if deck is None:
+            raise ValueError(f"抽出できるデッキが足りません（Tierが登録されたデッキ {len(drawn)} 個で候補がなくなりました）")
+
+        drawn.append(deck)
+        tier_sum += tier
+        tier_count += 1
+    return drawn
+
+# 抽出の記録（シード・プール・条件から結果を再現できる）
+DRAW_LOG_PATH = "cache/draw_log.jsonl"
+
+# 抽出履歴に表示する件数（新しい順）
+DRAW_LOG_DISPLAY_LIMIT = 200
+
+# 抽出対象のハッシュ
+# 均一ルールでは結果が変わるので、プールと所持デッキのTierも含める
+def draw_pool_hash(pool, target=None, player_decks=()):
+    if target is None:
+        data = "\n".join(pool)
+    else:
+        owned = [normalize_deck_name(deck) for deck in player_decks]
+        data = "\n".join(f"{deck}\t{tier}" for deck, tier in zip(pool, tiers_of_decks(pool)))
+        data += "\n--\n" + "\n".join(f"{deck}\t{tier}" for deck, tier in zip(owned, tiers_of_decks(owned)))
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+# シード欄の入力（空欄ならセッションの乱数から新しく作る）
+def parse_draw_seed(text):
+    text = text.strip()
+    if text == "":
+        return st.session_state.draw_rng.getrandbits(32)
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError(f"シードは整数で入力してください: {text}")
+
+# 条件とシードから抽出する（同じ条件・シード・プールなら同じ結果）
+def draw_decks(pool, k, player_decks=(), target=None, seed=None):
+    rng = random.Random(seed)
+    if target is None and not player_decks:
+        return sample_decks(pool, k, rng=rng)
+    return draw_player_decks(pool, k, player_decks, target, rng)
+
+# 抽出して記録を残す。記録には結果の画像ではなくデッキ名だけを持つ
+def run_draw(kind, pool, k, player_decks=(), target=None, seed=None, log_path=DRAW_LOG_PATH):
+    if seed is None:
+        seed = st.session_state.draw_rng.getrandbits(32)
+    player_decks = list(player_decks)
+    result = draw_decks(pool, k, player_decks, target, seed)
+    record = {
+        "id": uuid.uuid4().hex[:8],
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "kind": kind,
+        "seed": seed,
+        "pool_hash": draw_pool_hash(pool, target, player_decks),
+        "k": k,
+        "player_decks": player_decks,
+        "target": target,
+        "result": result,
+    }
+    st.session_state.draw_log.append(record)
+    try:
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"抽出記録の保存に失敗しました: {e}")
+    return record
+
+# 記録から抽出をやり直す（プールが記録時と違えばValueError）
+def regenerate_draw(record, pool):
+    if draw_pool_hash(pool, record["target"], record["player_decks"]) != record["pool_hash"]:
+        raise ValueError("デッキリスト・所持デッキのTier・プールのTierのいずれかが記録時と異なるため再現できません。")
+    return draw_decks(pool, record["k"], record["player_decks"], record["target"], record["seed"])
+
+# 抽出記録のファイルを読み込む（更新時刻とサイズが同じなら読み直さない）
+@st.cache_data(max_entries=4, show_spinner=False)
+def read_draw_log(path, mtime_ns, size):
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # 書き込み途中の行は読み飛ばす
+                continue
+    return records
+
+# 過去のセッションも含めた抽出記録（新しい順）
+def load_draw_log(kind, log_path=DRAW_LOG_PATH):
+    try:
+        stat = os.stat(log_path)
+        records = read_draw_log(log_path, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        records = []
+    # ファイルに書けなかった記録もセッションには残っている
+    ids = {record["id"] for record in records}
+    records = records + [record for record in st.session_state.draw_log if record["id"] not in ids]
+    return [record for record in reversed(records) if record["kind"] == kind]
+
+# 抽出記録を表示し、選んだ記録を再現する
+def show_draw_log(kind, pool):
+    records = load_draw_log(kind)
+    if not records:
+        return
+    with st.expander("抽出履歴"):
+        search = st.text_input("IDまたはシードで絞り込み", key=f"draw_log_search_{kind}").strip()
+        if search:
+            records = [r for r in records if search in (r["id"], str(r["seed"]))]
+        records = records[:DRAW_LOG_DISPLAY_LIMIT]
+        if not records:
+            st.info("該当する抽出記録はありません。")
+            return
+        st.dataframe(pd.DataFrame(
+            [[r["id"], r["time"], r["seed"], r["pool_hash"], r["k"], r["target"], ", ".join(r["result"])] for r in records],
+            columns=["ID", "日時", "シード", "プール", "個数", "均一の基準", "結果"],
+        ))
+        labels = [f'{r["id"]}  {r["time"]}  シード {r["seed"]}' for r in records]
+        selected = st.selectbox("再現する抽出", labels, key=f"draw_log_{kind}")
+        if st.button("再現", key=f"draw_regenerate_{kind}"):
+            record = records[labels.index(selected)]
+            try:
+                result = regenerate_draw(record, pool)
+            except ValueError as e:
+                st.error(e)
+            else:
+                if result == record["result"]:
+                    st.success(f"記録と同じ結果になりました: {', '.join(result)}")
+                else:
+                    st.warning(f"記録と異なる結果になりました: {', '.join(result)}")
 
 # new_player_list を player にコピーする　(GitHubリポジトリで使用する場合)
 def save_csv():
@@ -432,197 +788,739 @@ def save_csv():
         st.sidebar.write("データの保存に失敗しました。")
 
 # GoogleDriveでデータを保存する場合
-def save_csv_to_cloud(df):
-    # player.csvのファイルID
-    FILE_ID = "1sTIqJlXNJuwfjeZDMCVMrzvRA5FkBKHZ"
-
-    df.to_csv("temp.csv", index=False)
-    media = MediaFileUpload("temp.csv", mimetype="text/csv", resumable=True)
-    st.session_state.service.files().update(fileId=FILE_ID, media_body=media).execute()
+# player.csvのファイルID
+PLAYER_FILE_ID = "1sTIqJlXNJuwfjeZDMCVMrzvRA5FkBKHZ"
+
+# アップロード後のファイルのバージョンを返す
+def save_csv_to_cloud(csv_data):
+    # 一時ファイルを作らずメモリ上のデータをそのままアップロード
+    media = MediaIoBaseUpload(io.BytesIO(csv_data), mimetype="text/csv", resumable=False)
+    meta = get_drive_service().files().update(
+        fileId=PLAYER_FILE_ID, media_body=media, fields="modifiedTime, md5Checksum"
+    ).execute()
+    invalidate_drive_file(PLAYER_FILE_ID)
+    return drive_file_version(meta)
 
 def load_csv_from_cloud():
-    FILE_ID = "1sTIqJlXNJuwfjeZDMCVMrzvRA5FkBKHZ"
+    return read_drive_csv(get_drive_service(), PLAYER_FILE_ID)
+
+# csvの文字列（Pythonのリテラル）をリスト・辞書に変換する
+def parse_player_field(value, field_type):
+    if isinstance(value, field_type):
+        return value
+    if not isinstance(value, str) or value.strip() == "":
+        return field_type()
+    try:
+        parsed = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return field_type()
+    return parsed if isinstance(parsed, field_type) else field_type()
+
+# プレイヤー一覧の一時保存先
+PLAYER_CSV_PATH = "player/new_player_list.csv"
+
+# プレイヤーのデッキリスト（image_names）と使用順（deck_order）
+# 読み込み時に1回だけ解析し、メモリ上はリスト・辞書のまま扱う。名前で直接引ける
+# 変更はすぐには書き込まず、flush()でまとめてcsvに保存する
+# 全セッションで共有するので、プレイヤーごとのロックで更新する（別のプレイヤーの更新は待たない）
+class PlayerStore:
+    def __init__(self):
+        self.players = {}
+        self.dirty = False
+        self.csv_cache = None
+        # Google Driveに未同期のプレイヤーと、最後に同期した内容のハッシュ
+        self.dirty_players = set()
+        self.synced_hash = None
+        # 最後に同期したときのGoogle Driveのファイルとプレイヤーごとのバージョン
+        self.remote_version = None
+        self.base_versions = {}
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()
+        self.player_locks = {}
+
+    @classmethod
+    def from_df(cls, df):
+        store = cls()
+        image_names = df["image_names"] if "image_names" in df.columns else [None] * len(df)
+        deck_orders = df["deck_order"] if "deck_order" in df.columns else [None] * len(df)
+        versions = df["version"] if "version" in df.columns else [0] * len(df)
+        for name, images, order, version in zip(df["名前"], image_names, deck_orders, versions):
+            if pd.isna(name):
+                continue
+            store.players[str(name)] = {
+                "image_names": parse_player_field(images, list),
+                "deck_order": parse_player_field(order, dict),
+                "version": 0 if pd.isna(version) else int(version),
+            }
+        store.base_versions = {name: player["version"] for name, player in store.players.items()}
+        return store
+
+    def player_lock(self, name):
+        with self.lock:
+            if name not in self.player_locks:
+                self.player_locks[name] = threading.Lock()
+            return self.player_locks[name]
+
+    def names(self):
+        with self.lock:
+            return list(self.players)
+
+    def __contains__(self, name):
+        return name in self.players
+
+    def __len__(self):
+        return len(self.players)
+
+    def get(self, name):
+        return self.players.get(name)
+
+    def decks(self, name):
+        player = self.players.get(name)
+        return list(player["image_names"]) if player else []
+
+    def deck_order(self, name):
+        player = self.players.get(name)
+        return dict(player["deck_order"]) if player else {}
+
+    # デッキを追加する（すでに登録済みならFalse）
+    def add_deck(self, name, image_name):
+        with self.player_lock(name):
+            image_list = self.players[name]["image_names"]
+            if image_name in image_list:
+                return False
+            image_list.append(image_name)
+            self.mark_dirty(name)
+        return True
+
+    # デッキを削除し、(image_namesから削除したか, deck_orderから削除したか) を返す
+    def remove_deck(self, name, image_name):
+        with self.player_lock(name):
+            player = self.players[name]
+            in_list = image_name in player["image_names"]
+            if in_list:
+                player["image_names"].remove(image_name)
+            in_order = player["deck_order"].pop(image_name, None) is not None
+            if in_list or in_order:
+                self.mark_dirty(name)
+        return in_list, in_order
+
+    def set_deck_order(self, name, deck_order):
+        with self.player_lock(name):
+            self.players[name]["deck_order"] = dict(deck_order)
+            self.mark_dirty(name)
+
+    def reset(self, name):
+        with self.player_lock(name):
+            player = self.players[name]
+            player["image_names"] = []
+            player["deck_order"] = {}
+            self.mark_dirty(name)
+
+    def add_player(self, name):
+        with self.lock:
+            if name in self.players:
+                return False
+            self.players[name] = {"image_names": [], "deck_order": {}, "version": 0}
+            self.mark_dirty(name)
+        return True
+
+    def remove_player(self, name):
+        with self.lock:
+            if self.players.pop(name, None) is None:
+                return False
+            self.mark_dirty(name)
+        return True
+
+    # 変更を記録する（書き込みはflush()でまとめて行う）。nameを省略すると全員
+    def mark_dirty(self, name=None):
+        with self.lock:
+            self.dirty = True
+            self.csv_cache = None
+            self.dirty_players.update(self.players if name is None else [name])
+
+    # 全プレイヤーのロックを取って処理する（同期・読み込み直しのとき）
+    def lock_all_players(self):
+        locks = [self.player_lock(name) for name in sorted(set(self.names()) | set(self.player_locks))]
+        for lock in locks:
+            lock.acquire()
+        return locks
+
+    # 別のPlayerStoreとの差分（内容が変わる・増えるプレイヤー, なくなるプレイヤー）
+    def diff(self, other):
+        with self.lock:
+            changed = [
+                name for name, player in other.players.items()
+                if name not in self.players
+                or self.players[name]["image_names"] != player["image_names"]
+                or self.players[name]["deck_order"] != player["deck_order"]
+            ]
+            removed = [name for name in self.players if name not in other.players]
+        return changed, removed
+
+    # アップロードしたcsvなどの内容を手元の変更として取り込み、(変更したプレイヤー, 削除したプレイヤー) を返す
+    # 差分のあるプレイヤーだけを未同期にする。バージョンは手元のものを引き継ぎ、同期のときに競合を判定する
+    def import_players(self, other):
+        locks = self.lock_all_players()
+        try:
+            with self.lock:
+                changed, removed = self.diff(other)
+                for name in changed:
+                    current = self.players.get(name)
+                    player = other.players[name]
+                    self.players[name] = {
+                        "image_names": list(player["image_names"]),
+                        "deck_order": dict(player["deck_order"]),
+                        "version": current["version"] if current else self.base_versions.get(name, 0),
+                    }
+                    self.mark_dirty(name)
+                for name in removed:
+                    del self.players[name]
+                    self.mark_dirty(name)
+        finally:
+            for lock in locks:
+                lock.release()
+        return changed, removed
+
+    # Google Driveの最新の内容とプレイヤー単位でマージする
+    # 未同期の変更があるプレイヤーは手元を優先し、同じプレイヤーが他でも更新されていたら競合として返す
+    def merge_remote(self, remote):
+        conflicts = []
+        locks = self.lock_all_players()
+        try:
+            with self.lock:
+                merged = {}
+                for name, remote_player in remote.players.items():
+                    if name not in self.dirty_players:
+                        merged[name] = remote_player
+                    elif remote_player["version"] != self.base_versions.get(name):
+                        conflicts.append(name)
+                        merged[name] = remote_player
+                    elif name in self.players:
+                        merged[name] = self.players[name]
+
+                for name in self.dirty_players:
+                    if name in remote.players or name not in self.players:
+                        continue
+                    if name in self.base_versions:
+                        # 他で削除されたプレイヤーを手元で更新していた
+                        conflicts.append(name)
+                    else:
+                        merged[name] = self.players[name]
+
+                self.players = merged
+                self.base_versions = dict(remote.base_versions)
+                self.dirty_players -= set(conflicts)
+                self.dirty = True
+                self.csv_cache = None
+        finally:
+            for lock in locks:
+                lock.release()
+        return conflicts
+
+    # 保存用のDataFrame（リスト・辞書はここで1回だけ文字列にする）
+    def to_df(self):
+        with self.lock:
+            rows = [
+                [name, str(player["image_names"]), str(player["deck_order"]), player["version"]]
+                for name, player in self.players.items()
+            ]
+        return pd.DataFrame(rows, columns=["名前", "image_names", "deck_order", "version"])
+
+    # 保存用のcsv（変更がなければ前回作ったものを使い回す）
+    def snapshot(self):
+        with self.lock:
+            if self.csv_cache is None:
+                self.csv_cache = self.to_df().to_csv(index=False).encode("utf-8")
+            return self.csv_cache
+
+    # 変更があれば一時ファイル経由でcsvを置き換える
+    def flush(self, path=PLAYER_CSV_PATH):
+        with self.flush_lock:
+            with self.lock:
+                if not self.dirty:
+                    return False
+                csv_data = self.snapshot()
+                self.dirty = False
+            write_file_atomic(path, csv_data)
+        return True
+
+# 全セッションで共有するプレイヤー一覧
+@st.cache_resource
+def shared_players():
+    return {"store": None, "lock": threading.Lock(), "sync_lock": threading.Lock()}
+
+# Google Driveから読み込んだプレイヤー一覧（読み込んだ内容を同期済みとする）
+def load_players_from_cloud():
+    path, version = fetch_drive_file(get_drive_service(), PLAYER_FILE_ID)
+    players = PlayerStore.from_df(read_cached_csv(path, version))
+    players.remote_version = version
+    players.synced_hash = hashlib.sha1(players.snapshot()).hexdigest()
+    return players
+
+def get_shared_players():
+    holder = shared_players()
+    with holder["lock"]:
+        if holder["store"] is None:
+            holder["store"] = load_players_from_cloud()
+    return holder["store"]
+
+# Google Driveの最新の内容をマージし、競合したプレイヤーを返す（sync_lockを取ってから呼ぶ）
+# 前回と同じバージョンならforce=Trueのときだけマージする
+def merge_players_from_cloud(players, force=False):
+    path, remote_version = fetch_drive_file(get_drive_service(), PLAYER_FILE_ID)
+    if remote_version == players.remote_version and not force:
+        return []
+    remote = PlayerStore.from_df(read_cached_csv(path, remote_version))
+    conflicts = players.merge_remote(remote)
+    players.remote_version = remote_version
+    players.synced_hash = hashlib.sha1(remote.snapshot()).hexdigest()
+    return conflicts
+
+# Google Driveから読み込み直す。未同期の変更があるプレイヤーは手元を残す
+def reload_players_from_cloud(players):
+    with shared_players()["sync_lock"]:
+        invalidate_drive_file(PLAYER_FILE_ID)
+        return merge_players_from_cloud(players, force=True)
+
+# 他の端末の保存と競合したプレイヤーを表示する（Google Driveの内容を優先）
+def show_player_conflicts(conflicts, area=st):
+    if conflicts:
+        area.warning(f"他の端末で先に更新されていたため、次のプレイヤーの変更は反映されませんでした: {', '.join(conflicts)}")
+
+# プレイヤー一覧をGoogle Driveに同期し、(アップロードしたか, 競合したプレイヤー) を返す
+# 前回の同期の後にGoogle Driveのファイルが更新されていれば（別の端末からの保存）、
+# 最新の内容を読み込んでプレイヤー単位でマージしてからアップロードする
+def sync_players_to_cloud(players):
+    with shared_players()["sync_lock"]:
+        invalidate_drive_file(PLAYER_FILE_ID)
+        conflicts = merge_players_from_cloud(players)
+
+        locks = players.lock_all_players()
+        try:
+            with players.lock:
+                # 更新したプレイヤーのバージョンを上げる
+                changed = set(players.dirty_players)
+                old_versions = {}
+                for name in changed:
+                    if name in players.players:
+                        old_versions[name] = players.players[name]["version"]
+                        players.players[name]["version"] = players.base_versions.get(name, 0) + 1
+                players.csv_cache = None
+                csv_data = players.snapshot()
+                content_hash = hashlib.sha1(csv_data).hexdigest()
+                players.dirty_players.clear()
+        finally:
+            for lock in locks:
+                lock.release()
+
+        if content_hash == players.synced_hash:
+            return False, conflicts
+
+        try:
+            players.remote_version = save_csv_to_cloud(csv_data)
+        except Exception:
+            # アップロードに失敗したら未同期に戻し、バージョンも戻す
+            with players.lock:
+                players.dirty_players.update(changed)
+                for name, version in old_versions.items():
+                    if name in players.players:
+                        players.players[name]["version"] = version
+                players.csv_cache = None
+                players.dirty = True
+            raise
+
+        with players.lock:
+            for name in changed:
+                if name in players.players:
+                    players.base_versions[name] = players.players[name]["version"]
+                else:
+                    players.base_versions.pop(name, None)
+        players.synced_hash = content_hash
+        return True, conflicts
+
+# セッションのプレイヤー一覧の変更をcsvに書き込む（リクエストの最後に1回）
+def flush_players():
+    if "players" in st.session_state:
+        try:
+            st.session_state.players.flush()
+        except OSError as e:
+            print(f"プレイヤー一覧の保存に失敗しました: {e}")
+
+# Tier索引の更新確認間隔（秒）
+TIER_INDEX_CHECK_INTERVAL = 2.0
+
+def tier_list_paths(tier_dir="Tier_List"):
+    return [os.path.join(tier_dir, f"Tier_List_{color}.csv") for color in COLOR_COLUMNS]
+
+# Tier_Listのcsvファイルの更新時刻（存在しない場合はNone）
+def tier_list_mtimes(tier_dir="Tier_List"):
+    mtimes = []
+    for path in tier_list_paths(tier_dir):
+        try:
+            mtimes.append(os.path.getmtime(path))
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+# 色別のTier_Listから 正規化デッキ名 → (Tier, 色) の辞書を作成
+def build_tier_index(tier_dir="Tier_List"):
+    index = {}
+    for color, path in zip(COLOR_COLUMNS, tier_list_paths(tier_dir)):
+        try:
+            df = pd.read_csv(path)
+        except FileNotFoundError:
+            print(f"ファイルが見つかりません: {path}")
+            continue
 
-    request = st.session_state.service.files().get_media(fileId=FILE_ID)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-    fh.seek(0)
-    return pd.read_csv(fh)
+        for deck_name, tier in zip(df["デッキ名"], df["Tier"]):
+            if pd.isna(deck_name):
+                continue
+            # 同名のデッキは先に見つかった色を優先
+            index.setdefault(normalize_text(deck_name), (float(tier), color))
+    return index
+
+# プロセス全体（全セッション共通）で保持するTier索引
+@st.cache_resource
+def tier_index_store():
+    return {"lock": threading.Lock(), "mtimes": None, "index": {}, "table": None, "checked_at": 0.0}
+
+# Tier索引を取得（csvの更新時刻が変わっていれば作り直す）
+def get_tier_index():
+    store = tier_index_store()
+    now = time.monotonic()
+    if store["mtimes"] is not None and now - store["checked_at"] < TIER_INDEX_CHECK_INTERVAL:
+        return store["index"]
+
+    with store["lock"]:
+        mtimes = tier_list_mtimes()
+        if mtimes != store["mtimes"]:
+            index = build_tier_index()
+            store["table"] = pd.DataFrame.from_dict(index, orient="index", columns=["Tier", "色"])
+            store["index"] = index
+            store["mtimes"] = mtimes
+        store["checked_at"] = now
+    return store["index"]
+
+# Tier表（index: 正規化デッキ名, 列: Tier, 色）を取得
+def get_tier_table():
+    get_tier_index()
+    return tier_index_store()["table"]
+
+# デッキ名を正規化（.pngが付いていれば外す）
+def normalize_deck_name(deck_name):
+    deck_name = normalize_text(deck_name)
+    return deck_name[:-4] if deck_name.endswith(".png") else deck_name
+
+# dfの全デッキ名を列順に1次元のリストにする（NaNは除く）
+def deck_names_of_df(df):
+    values = df.to_numpy(dtype=object).ravel(order="F")
+    return [val for val in values if pd.notna(val)]
+
+# デッキ名（リスト・Series・DataFrame）のTierをまとめて取得する
+# 未登録のデッキはNaN。DataFrameを渡した場合は同じ形のDataFrameを返す
+def tiers_of_decks(names):
+    if isinstance(names, pd.DataFrame):
+        return pd.DataFrame({col: tiers_of_decks(names[col]) for col in names.columns}, index=names.index)
+
+    if not isinstance(names, pd.Series):
+        names = pd.Series(list(names), dtype=object)
+
+    normalized = names.map(normalize_deck_name, na_action="ignore")
+    return normalized.map(get_tier_table()["Tier"]).astype(float)
 
 # デッキ名からTierを出力する
 def Tier_of_Deck(deck_name):
-    # listフォルダ内のcsvファイルを取得
-    try:
-        Tier_df_red = pd.read_csv("Tier_List/Tier_List_赤.csv")
-        Tier_df_bulue = pd.read_csv("Tier_List/Tier_List_青.csv")
-        Tier_df_green = pd.read_csv("Tier_List/Tier_List_緑.csv")
-        Tier_df_yellow = pd.read_csv("Tier_List/Tier_List_黄.csv")
-        Tier_df_purple = pd.read_csv("Tier_List/Tier_List_紫.csv")
-        Tier_df = pd.concat(
-            [Tier_df_red, Tier_df_bulue, Tier_df_green, Tier_df_yellow, Tier_df_purple],
-            ignore_index=True
-        )
-    except FileNotFoundError:
-        st.error(f"フォルダが見つかりません: {folder_path}")
-        return None    
+    entry = get_tier_index().get(normalize_text(deck_name))
+    if entry is None:
+        st.error("デッキ名がTier_Listに登録されていません")
+        return None
+
+    return entry[0]
 
-    # deck_name を正規化
-    normalized_deck_name = normalize_text(deck_name)
+# デッキカタログのスナップショット（形式を変えたらバージョンを上げる）
+DECK_CATALOG_SNAPSHOT = "cache/deck_catalog.json"
+DECK_CATALOG_VERSION = 1
+# デッキカタログの更新確認間隔（秒）
+DECK_CATALOG_CHECK_INTERVAL = 2.0
 
-    # データフレーム内のデッキ名もすべて正規化
-    Tier_df["デッキ名_正規化"] = Tier_df["デッキ名"].map(normalize_text)
+# 画像フォルダとTier_Listの状態（更新時刻）。変わったらカタログを作り直す
+def deck_catalog_signature(image_root="image"):
+    return json.dumps({
+        "version": DECK_CATALOG_VERSION,
+        "image_dirs": image_dir_mtimes(image_root),
+        "tier_lists": list(tier_list_mtimes()),
+    })
 
+# 画像フォルダを走査してデッキカタログ（デッキ名, 色, タイトル, Tier, 画像パス）を作成
+def build_deck_catalog(image_root="image"):
+    rows = []
+    for color, column in COLOR_COLUMNS.items():
+        folder_path = os.path.join(image_root, color)
+        for file in list_png_files(folder_path):
+            deck_name = file.replace(".png", "")
+            match = re.match(r"^(.*?)\(", deck_name)
+            rows.append({
+                "デッキ名": deck_name,
+                "色": column,
+                "タイトル": match.group(1) if match else deck_name,
+                "画像パス": os.path.join(folder_path, file),
+            })
+
+    catalog = pd.DataFrame(rows, columns=["デッキ名", "色", "タイトル", "画像パス"])
+    catalog["Tier"] = tiers_of_decks(catalog["デッキ名"])
+    return catalog
+
+# ファイルを一時ファイル経由で書き込む（書き込み途中のファイルを読ませない）
+def write_file_atomic(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def load_deck_catalog_snapshot(signature, snapshot_path=DECK_CATALOG_SNAPSHOT):
     try:
-        Tier_num = Tier_df[Tier_df["デッキ名_正規化"] == normalized_deck_name]["Tier"].values[0]
-    except IndexError:
-        st.error("デッキ名がTier_Listに登録されていません")
+        with open(snapshot_path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
         return None
 
-    return Tier_num
+    if snapshot.get("signature") != signature:
+        return None
+    return pd.DataFrame(snapshot["decks"], columns=["デッキ名", "色", "タイトル", "画像パス", "Tier"])
+
+def save_deck_catalog_snapshot(catalog, signature, snapshot_path=DECK_CATALOG_SNAPSHOT):
+    snapshot = {
+        "signature": signature,
+        "decks": json.loads(catalog.to_json(orient="records", force_ascii=False)),
+    }
+    try:
+        write_file_atomic(snapshot_path, json.dumps(snapshot, ensure_ascii=False))
+    except OSError as e:
+        print(f"カタログの保存に失敗しました: {e}")
+
+# デッキカタログをプロセス全体で共有する
+# スナップショットが最新ならフォルダの走査とTierの解決を省略する
+@st.cache_resource(max_entries=1)
+def load_deck_catalog(signature):
+    catalog = load_deck_catalog_snapshot(signature)
+    if catalog is None:
+        catalog = build_deck_catalog()
+        save_deck_catalog_snapshot(catalog, signature)
+
+    tier_keys = "Tier" + catalog["Tier"].astype(str)
+    return {
+        "catalog": catalog,
+        "color_df": group_decks_to_df(catalog["色"], catalog["デッキ名"], list(COLOR_COLUMNS.values())),
+        "tier_df": group_decks_to_df(tier_keys, catalog["デッキ名"], TIER_COLUMNS),
+    }
+
+# 最後に確認したカタログの状態（確認間隔内はファイルの更新時刻を見に行かない）
+@st.cache_resource
+def deck_catalog_store():
+    return {"signature": None, "checked_at": 0.0}
+
+def get_deck_catalog():
+    store = deck_catalog_store()
+    now = time.monotonic()
+    if store["signature"] is None or now - store["checked_at"] >= DECK_CATALOG_CHECK_INTERVAL:
+        store["signature"] = deck_catalog_signature()
+        store["checked_at"] = now
+    return load_deck_catalog(store["signature"])
+
+# 画像マニフェスト（正規化デッキ名 → 画像の絶対パス, 色, サイズ, ハッシュ）
+IMAGE_MANIFEST_SNAPSHOT = "cache/image_manifest.json"
+IMAGE_MANIFEST_VERSION = 2
+# 画像フォルダの更新確認間隔（秒）
+IMAGE_MANIFEST_CHECK_INTERVAL = 5.0
+
+# 画像ファイルを走査してマニフェストを作成
+def build_image_manifest(image_root="image"):
+    manifest = {}
+    for color in COLOR_COLUMNS:
+        folder_path = os.path.join(image_root, color)
+        for file in sorted(list_png_files(folder_path)):
+            path = os.path.abspath(os.path.join(folder_path, file))
+            deck_name = normalize_deck_name(file)
+            # 同名のデッキは先に見つかった色を優先
+            if deck_name in manifest:
+                continue
+
+            try:
+                with open(path, "rb") as f:
+                    content = f.read()
+                with Image.open(io.BytesIO(content)) as img:
+                    width, height = img.size
+            except Exception as e:
+                print(f"画像の読み込みに失敗しました: {path} ({e})")
+                continue
+
+            manifest[deck_name] = {
+                "path": path,
+                "color": color,
+                "width": width,
+                "height": height,
+                "hash": hashlib.sha1(content).hexdigest(),
+            }
+    return manifest
+
+# 画像ファイルごとの (色, ファイル名, 更新時刻, サイズ)
+# 同じ名前で上書きされた画像はフォルダの更新時刻が変わらないので、ファイルごとに見る
+def image_file_stats(image_root="image"):
+    stats = []
+    for color in COLOR_COLUMNS:
+        try:
+            with os.scandir(os.path.join(image_root, color)) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".png"):
+                        stat = entry.stat()
+                        stats.append([color, entry.name, stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            continue
+    return sorted(stats)
+
+def load_image_manifest(image_files, snapshot_path=IMAGE_MANIFEST_SNAPSHOT):
+    # 絶対パスを保存するので、画像フォルダの場所も署名に含める
+    signature = {"version": IMAGE_MANIFEST_VERSION, "root": os.path.abspath("image"), "image_files": image_files}
+    try:
+        with open(snapshot_path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+        if snapshot.get("signature") == signature:
+            return snapshot["images"]
+    except (OSError, ValueError):
+        pass
+
+    manifest = build_image_manifest()
+    try:
+        write_file_atomic(snapshot_path, json.dumps({"signature": signature, "images": manifest}, ensure_ascii=False))
+    except OSError as e:
+        print(f"画像マニフェストの保存に失敗しました: {e}")
+    return manifest
+
+# プロセス全体（全セッション共通）で保持する画像マニフェスト
+@st.cache_resource
+def image_manifest_store():
+    return {"lock": threading.Lock(), "files": None, "manifest": {}, "checked_at": 0.0}
+
+# 画像マニフェストを取得（画像ファイルが変わっていれば作り直す）
+def get_image_manifest():
+    store = image_manifest_store()
+    now = time.monotonic()
+    if store["files"] is not None and now - store["checked_at"] < IMAGE_MANIFEST_CHECK_INTERVAL:
+        return store["manifest"]
+
+    with store["lock"]:
+        files = image_file_stats("image")
+        if files != store["files"]:
+            store["manifest"] = load_image_manifest(files)
+            store["files"] = files
+        store["checked_at"] = now
+    return store["manifest"]
 
 # my_deck_listからTier平均を出力
 def Avg_Tier_of_Deck(selected_player):
-    # image_namesを取得（安全に抽出）
-    try:
-        image_names_raw = st.session_state.player_df[
-            st.session_state.player_df["名前"] == selected_player
-        ]["image_names"].values[0]
-    except IndexError:
+    if selected_player not in st.session_state.players:
         st.warning("プレイヤーデータが見つかりません。")
         return None
 
-    image_list = ast.literal_eval(image_names_raw) if isinstance(image_names_raw, str) else image_names_raw
+    image_list = st.session_state.players.decks(selected_player)
 
-    if not isinstance(image_list, list) or len(image_list) == 0:
+    if len(image_list) == 0:
         return None
 
     # 各デッキのTierを取得し、平均を計算
-    tier_values = []
-    for image_name in image_list:
-        deck_name = image_name.replace(".png", "")
-        tier = Tier_of_Deck(deck_name)
-        if tier is not None:
-            tier_values.append(tier)
-
-    if not tier_values:
+    tier_values = tiers_of_decks(image_list).dropna()
+
+    if tier_values.empty:
         st.warning("Tier情報が取得できませんでした。")
         return None
 
-    avg_tier = sum(tier_values) / len(tier_values)
+    avg_tier = tier_values.mean()
     truncated_avg = math.floor(avg_tier * 100) / 100  # 小数第2位で切り捨て
 
     return truncated_avg
 
 # player毎にimage_nameのリストを格納
 def save_image_names(player, image_name):
-    # プレイヤーの行インデックスを取得
-    player_idx = st.session_state.player_df[st.session_state.player_df["名前"] == player].index[0]
-
-    # 現在の画像リストを取得（空なら空リスト）
-    current_images = st.session_state.player_df.at[player_idx, "image_names"]
-    
-    if pd.isna(current_images) or current_images == "":
-        image_list = []
-    else:
-        try:
-            image_list = ast.literal_eval(current_images)
-        except (ValueError, SyntaxError):
-            st.warning("画像リストの読み取りに失敗しました。新しく初期化します。")
-            image_list = []
-
     # 重複しないように追加
-    if image_name in image_list:
+    if not st.session_state.players.add_deck(player, image_name):
         st.warning("この画像はすでに追加されています。")
     else:
-        image_list.append(image_name)
-        st.session_state.player_df.at[player_idx, "image_names"] = str(image_list)
-        st.session_state.player_df.to_csv("player/new_player_list.csv", index=False)
         st.success(f"{image_name} を {player} に追加しました！")
 
-# dfにimage_nameを格納
-def save_image_names_to_df(df, selected_column, image_name):
-
-    deck_name = image_name.replace(".png", "")
-
-    # すでに同じdeck_nameが列に存在する場合は警告を表示
-    if deck_name in df[selected_column].values:
-        st.warning(f"警告: `{deck_name}` はすでに列 `{selected_column}` に存在します。")
-
-    # 指定された列にNaNがある場合、そのNaNをdeck_nameで埋める
-    elif df[selected_column].isna().any():  # NaNが1つでもあるか確認
-        # 最初のNaNを見つけてdeck_nameを代入
-        nan_index = df[df[selected_column].isna()].index[0]
-        df.at[nan_index, selected_column] = deck_name
-    else:
-        # NaNがなければ、新しい行を追加してdeck_nameを挿入
-        new_row = {col: None for col in df.columns}  # 既存列名に対してNoneの辞書を作成
-        new_row[selected_column] = deck_name  # 指定された列にデッキ名を挿入
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-
-    return df
-
 # df1とdf2を結合（df1にdf2をマージ）
 def merge_dfs_with_function(df1, df2):
     df1_normalized = normalize_dataframe(df1)
     df2_normalized = normalize_dataframe(df2)
 
-    merged_df = df1_normalized.copy()
+    merged = DeckColumns.from_df(df1_normalized)
 
     for col in df2_normalized.columns:
-        for val in df2_normalized[col].dropna():
-            image_name = str(val) + ".png" if not str(val).endswith(".png") else str(val)
-            merged_df = save_image_names_to_df(merged_df, col, image_name)
-
-    return merged_df
+        for deck_name in merged.extend(col, df2_normalized[col].dropna()):
+            st.warning(f"警告: `{deck_name}` はすでに列 `{col}` に存在します。")
+
+    return merged.to_df()
+
+# 縮小画像のキャッシュ（元画像のハッシュと幅でファイル名を決める）
+THUMBNAIL_DIR = "cache/thumbnails"
+THUMBNAIL_WIDTHS = (150, 300)
+
+@st.cache_resource
+def thumbnail_store():
+    return {"lock": threading.Lock(), "paths": {}}
+
+# 縮小画像を作成して保存する（WebPが使えなければPNG）
+def build_thumbnail(entry, width, thumbnail_dir=THUMBNAIL_DIR):
+    image_format = "WEBP" if features.check("webp") else "PNG"
+    path = os.path.join(thumbnail_dir, f"{entry['hash']}_{width}.{image_format.lower()}")
+    if os.path.exists(path):
+        return path
+
+    with Image.open(entry["path"]) as img:
+        img = img.convert("RGBA")
+        height = max(1, round(img.height * width / img.width))
+        img = img.resize((width, height), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format=image_format)
+    write_file_atomic(path, buffer.getvalue())
+    return path
+
+# 表示幅に合った縮小画像のパスを返す（元画像より大きくはしない）
+def get_thumbnail(entry, display_width):
+    width = next((w for w in THUMBNAIL_WIDTHS if w >= display_width), THUMBNAIL_WIDTHS[-1])
+    if width >= entry["width"]:
+        return entry["path"]
+
+    store = thumbnail_store()
+    key = (entry["hash"], width)
+    if key not in store["paths"]:
+        with store["lock"]:
+            if key not in store["paths"]:
+                try:
+                    store["paths"][key] = build_thumbnail(entry, width)
+                except Exception as e:
+                    print(f"縮小画像の作成に失敗しました: {entry['path']} ({e})")
+                    return entry["path"]
+    return store["paths"][key]
 
 # 名前から画像を表示する
-def output_image(df, image_name, name_disp=True):
-
-    image_path_red = os.path.join("image/赤", image_name)
-    image_path_bulue = os.path.join("image/青", image_name)
-    image_path_green = os.path.join("image/緑", image_name)
-    image_path_yellow = os.path.join("image/黄", image_name)
-    image_path_purple = os.path.join("image/紫", image_name)
-
-    target_value = normalize_text(image_name.replace(".png", ""))
-    found = False
-    for row_idx in range(len(df)):
-        for col_idx in range(len(df.columns)):
-            cell_value = df.iat[row_idx, col_idx]
-            if pd.notna(cell_value) and normalize_text(cell_value) == target_value:
-                col_name = df.columns[col_idx]
-                if name_disp:
-                    st.write(f"{target_value}")
-                found = True
-                break
-        if found:
-            break
+def output_image(image_name, name_disp=True, width=150):
+    deck_name = normalize_deck_name(image_name)
+    entry = get_image_manifest().get(deck_name)
 
-    if os.path.exists(image_path_red):
-        st.image(image_path_red, width=150, use_container_width=False)
-        if name_disp:
-            st.subheader(f"Tier : {Tier_of_Deck(target_value)}")
-    elif os.path.exists(image_path_bulue):
-        st.image(image_path_bulue, width=150, use_container_width=False)
-        if name_disp:
-            st.subheader(f"Tier : {Tier_of_Deck(target_value)}")
-    elif os.path.exists(image_path_green):
-        st.image(image_path_green, width=150, use_container_width=False)
-        if name_disp:
-            st.subheader(f"Tier : {Tier_of_Deck(target_value)}")
-    elif os.path.exists(image_path_yellow):
-        st.image(image_path_yellow, width=150, use_container_width=False)
-        if name_disp:
-            st.subheader(f"Tier : {Tier_of_Deck(target_value)}")
-    elif os.path.exists(image_path_purple):
-        st.image(image_path_purple, width=150, use_container_width=False)
-        if name_disp:
-            st.subheader(f"Tier : {Tier_of_Deck(target_value)}")
-    else:
+    if name_disp:
+        st.write(f"{deck_name}")
+
+    if entry is None:
         st.error(f"画像ファイルが見つかりません")
+        return
+
+    st.image(get_thumbnail(entry, width), width=width, use_container_width=False)
+    if name_disp:
+        st.subheader(f"Tier : {Tier_of_Deck(deck_name)}")
 
 # データフレームの要素を3列で全て表示(selectboxで列を指定して表示)
 def three_way_output_image(df, selected_column=None, selected_title=None, selected_player=None, selected_df=None):
@@ -643,7 +1541,7 @@ def three_way_output_image(df, selected_column=None, selected_title=None, select
         cols = st.columns(3)
         for j, image_name in enumerate(image_names[i:i+3]):
             with cols[j]:
-                output_image(df, image_name)
+                output_image(image_name)
                 if selected_player is not None:
                     if st.button(f'{selected_player}に登録',key=f"image_{i}_{j}"):
                         save_image_names(selected_player, image_name)
@@ -655,7 +1553,7 @@ def three_way_output_image(df, selected_column=None, selected_title=None, select
                             selected_column = next((col for col in selected_df.columns 
                                 if deck_name in selected_df[col].values), None)
 
-                        if selected_column in ["Tier1.0", "Tier1.5", "Tier2.0", "Tier2.5", "Tier3.0", "Tier4.0", "Tier5.0"]:
+                        if selected_column in TIER_COLUMNS:
                             if "create_df_temp2" in st.session_state and not st.session_state.create_df_temp2.empty:
                                 # selected_columnをTier_numから色に変える
                                 deck_name = image_name.replace(".png", "")
@@ -665,54 +1563,29 @@ def three_way_output_image(df, selected_column=None, selected_title=None, select
                                         break
                             
                         # selected_dfにデッキを登録
-                        st.session_state.create_df_temp = save_image_names_to_df(st.session_state.create_df_temp, selected_column, image_name)     
+                        if not st.session_state.create_df_temp.add(selected_column, image_name):
+                            st.warning(f"警告: `{image_name.replace('.png', '')}` はすでに列 `{selected_column}` に存在します。")
         st.write("_____________________________________________________________")              
 
 # 指定プレイヤーの image_names から特定の image_name を削除する関数
 def remove_image_name(player, image_name):
-    # プレイヤーの行インデックスを取得
-    player_idx = st.session_state.player_df[st.session_state.player_df["名前"] == player].index[0]
+    players = st.session_state.players
 
-    # 現在の画像リストを取得（空なら空リスト）
-    current_images = st.session_state.player_df.at[player_idx, "image_names"]
-
-    if pd.isna(current_images) or current_images == "":
+    if not players.decks(player):
         st.warning("画像リストは空です。削除できる画像がありません。")
         return
-    else:
-        try:
-            image_list = ast.literal_eval(current_images)
-        except (ValueError, SyntaxError):
-            st.error("画像リストの読み取りに失敗しました。")
-            return
 
-    # 画像がリストにある場合のみ削除
-    if image_name in image_list:
-        image_list.remove(image_name)
-        st.session_state.player_df.at[player_idx, "image_names"] = str(image_list)
-        st.session_state.player_df.to_csv("player/new_player_list.csv", index=False)
+    # 画像がリストにある場合のみ削除（deck_order からも削除）
+    in_list, in_order = players.remove_deck(player, image_name)
+
+    if in_list:
         st.success(f"{image_name} を {player} から削除しました！")
     else:
         st.warning("指定された画像はリストに存在しません。")
 
-    # --- 追加: deck_order からも削除 ---
-    try:
-        deck_order_raw = st.session_state.player_df.at[player_idx, "deck_order"]
-        if isinstance(deck_order_raw, str):
-            deck_order = ast.literal_eval(deck_order_raw)
-        elif isinstance(deck_order_raw, dict):
-            deck_order = deck_order_raw
-        else:
-            deck_order = {}
+    if in_order:
+        st.info(f"{image_name} を deck_order からも削除しました。")
 
-        if image_name in deck_order:
-            del deck_order[image_name]
-            st.session_state.player_df.at[player_idx, "deck_order"] = str(deck_order)
-            st.session_state.player_df.to_csv("player/new_player_list.csv", index=False)
-            st.info(f"{image_name} を deck_order からも削除しました。")
-    except Exception as e:
-        st.warning(f"deck_order の更新中にエラーが発生しました: {e}")
-    
 # ダウンロード用の関数
 def download_dataframe_as_csv(filename: str, df: pd.DataFrame):
     if df is not None and not df.empty:
@@ -721,7 +1594,7 @@ def download_dataframe_as_csv(filename: str, df: pd.DataFrame):
             filename += ".csv"
 
         # データをCSV形式にエンコード（バイトIOで）
-        buffer = BytesIO()
+        buffer = io.BytesIO()
         df.to_csv(buffer, index=False, encoding="utf-8-sig")
         buffer.seek(0)
 
@@ -787,17 +1660,10 @@ def csv_app():
         check_box = st.checkbox("アップロードファイルを表示")
         if check_box:
             st.dataframe(st.session_state.df)
-            tier_values = []
+            tier_values = tiers_of_decks(deck_names_of_df(st.session_state.df)).dropna()
 
-            for col in st.session_state.df.columns:
-                for val in st.session_state.df[col]:
-                    if pd.notna(val):
-                        tier_num = Tier_of_Deck(val)
-                        if tier_num is not None:
-                            tier_values.append(tier_num)
-
-            if tier_values:
-                average_tier = sum(tier_values) / len(tier_values)
+            if not tier_values.empty:
+                average_tier = tier_values.mean()
                 st.write(f"総デッキ数: {len(tier_values)}")
                 st.write(f"平均Tier: {average_tier:.2f}")
 
@@ -937,16 +1803,16 @@ def create_csv_2():
         st.rerun()
     ##############################################################
 
-    if not st.session_state.create_df_temp.empty:
+    if not st.session_state.create_df_temp.is_empty():
         check_box_2 = st.checkbox("作成ファイルを表示")
         if check_box_2:
-            st.dataframe(st.session_state.create_df_temp)
+            st.dataframe(st.session_state.create_df_temp.to_df())
 
-    if df1 is not None and not st.session_state.create_df_temp.empty:
+    if df1 is not None and not st.session_state.create_df_temp.is_empty():
         st.write("_____________________________________________________________")
         if st.button("２つのCSVファイルを結合"):
             # 結合と保存
-            combined_df = merge_dfs_with_function(df1, st.session_state.create_df_temp)
+            combined_df = merge_dfs_with_function(df1, st.session_state.create_df_temp.to_df())
             st.session_state.combined_df = combined_df  # 一時的に保存
             st.subheader("結合されたデータフレーム")
             st.dataframe(combined_df)
@@ -1017,7 +1883,7 @@ def create_csv_3_1():
     elif select_method == "Tier別":
         # DataFrameが st.session_state に存在するか確認
         if "Tier_df" in st.session_state and not st.session_state.Tier_df.empty:
-            tier_list = ["Tier1.0", "Tier1.5", "Tier2.0", "Tier2.5", "Tier3.0", "Tier4.0", "Tier5.0"]
+            tier_list = TIER_COLUMNS
 
             # 列名を取得してセレクトボックスで表示
             selected_column = st.selectbox(
@@ -1035,14 +1901,14 @@ def create_csv_3_1():
             st.warning("データフレームが存在しないか空です。")
 
     if st.sidebar.button("CSVとして保存"):
-        st.session_state.create_df = st.session_state.create_df_temp
+        st.session_state.create_df = st.session_state.create_df_temp.to_df()
         st.sidebar.success("アップロードファイルとして保存しました")
 
-    st.sidebar.dataframe(st.session_state.create_df_temp)
+    st.sidebar.dataframe(st.session_state.create_df_temp.to_df())
     # 作成したデータフレーム確認
     for col in st.session_state.create_df_temp.columns:
         st.sidebar.write(f"{col} ")
-        st.sidebar.write(st.session_state.create_df_temp[col].dropna().tolist())
+        st.sidebar.write(st.session_state.create_df_temp.values[col])
 # ランダム抽出
 def random_app():
     st.title("ランダム抽出")
@@ -1058,7 +1924,7 @@ def random_app():
         # 名前の選択ボックス
         selected_player = st.selectbox(
             label="プレイヤーを選択してください",
-            options=st.session_state.player_df["名前"]
+            options=st.session_state.players.names()
         )
         # 選択したプレイヤーの平均Tier
         avg_tier = Avg_Tier_of_Deck(selected_player)
@@ -1071,68 +1937,33 @@ def random_app():
 
         # 均一ルールをオンにチェックボックス
         st.session_state.uniform_role_flag = st.checkbox("均一ルール")
+        target = None
         if st.session_state.uniform_role_flag:
-            st.session_state.select_output_style = st.radio("均一の基準にする数値",["全デッキの平均Tier","2.0","3.0","4.0"], horizontal=True)
+            st.session_state.select_output_style = st.radio("均一の基準にする数値", UNIFORM_TARGETS, horizontal=True)
+            target = uniform_target(st.session_state.select_output_style)
         # ランダムで出力するデッキ数を選択
         random_deck_num = st.slider("出力するデッキ数", 1, 10, st.session_state.output_deck_num_default)
         # スライダーのデフォルトを設定
         st.session_state.output_deck_num_default = random_deck_num
 
-        # ランダム関数を使ってDFから１つ選択する。内容がNoneなら再度実施する
+        # デッキリストからまとめて抽出する（候補が足りなければエラーを表示）
         # ボタンを押したらランダム抽出
+        seed_text = st.text_input("シード（空欄ならランダム）", key="draw_seed")
         if st.button("ランダム抽出"):
-            st.session_state.output_decks = []
-
-            for _ in range(random_deck_num):
-
-                if st.session_state.output_decks != []:
-                    player_decks = st.session_state.player_df[st.session_state.player_df["名前"] == selected_player]["image_names"].values[0]
-                    if not pd.isna(player_decks):
-                        # player_decksをstrからリスト形式に
-                        player_decks = re.findall(r"\['(.*?)'\]", player_decks)
-                        player_decks_temp = []
-                        for deck in player_decks:
-                            deck_name = deck.replace(".png", "")
-                            player_decks_temp.append(deck_name)
-                        # シングルクォートとカンマで分割
-                        if player_decks_temp and isinstance(player_decks_temp[0], str):
-                            player_decks_temp = [deck.strip(" '") for deck in player_decks_temp[0].split(",")]
-                        else:
-                            player_decks_temp = []
-                        deck_list_temp = st.session_state.output_decks + player_decks_temp
-                    else:
-                        deck_list_temp = st.session_state.output_decks
-                        
-                    sum_tier_temp = 0
-                    for i in range(0, len(deck_list_temp)):
-                        sum_tier_temp += Tier_of_Deck(deck_list_temp[i])
-
-                    avg_tier_temp = sum_tier_temp / len(deck_list_temp)
-                else:
-                    deck_list_temp = []
-                    avg_tier_temp = avg_tier
-
-                if st.session_state.uniform_role_flag and avg_tier_temp is not None:
-                    p = st.session_state.avg_tier
-                    while True:
-                        random_value = get_random(st.session_state.df)
-                        # 重複してたらもう一度実行する
-                        if random_value not in deck_list_temp:
-                            deck_tier = Tier_of_Deck(random_value)
-                            if avg_tier_temp < p:
-                                if deck_tier > p:
-                                    break
-                            else:
-                                if deck_tier < p:
-                                    break
-                else:
-                    while True:
-                        random_value = get_random(st.session_state.df)
-                        # 重複してたらもう一度実行する
-                        if random_value not in deck_list_temp:
-                            break
-
-                st.session_state.output_decks.append(random_value)
+            try:
+                record = run_draw(
+                    "ランダム抽出",
+                    deck_pool(st.session_state.df),
+                    random_deck_num,
+                    st.session_state.players.decks(selected_player),
+                    target,
+                    parse_draw_seed(seed_text),
+                )
+                st.session_state.output_decks = record["result"]
+                st.caption(f"シード: {record['seed']}")
+            except ValueError as e:
+                st.session_state.output_decks = []
+                st.error(e)
 
         # 画像表示（選ばれていれば常に表示）
         if st.session_state.output_decks != []:
@@ -1142,12 +1973,14 @@ def random_app():
                 for j, image_name in enumerate(st.session_state.output_decks[i:i+3]):
                     with cols[j]:
                         output_image_name = image_name + ".png"
-                        output_image(st.session_state.df, output_image_name)
+                        output_image(output_image_name)
 
             if st.button(f'{selected_player}にこのデッキを登録する'):
                 for i in range(0, len(st.session_state.output_decks)):
                     output_image_name = st.session_state.output_decks[i] + ".png"
                     save_image_names(selected_player, output_image_name)
+
+        show_draw_log("ランダム抽出", deck_pool(st.session_state.df))
 # デッキ_カスタマイズ
 def customize():
     st.title('デッキリストカスタマイズ')
@@ -1156,7 +1989,7 @@ def customize():
     # 名前の選択ボックス
     selected_player = st.selectbox(
         label="プレイヤーを選択してください",
-        options=st.session_state.player_df["名前"]
+        options=st.session_state.players.names()
     )
     # 選んだ名前の表示
     st.write(f"選択されたプレイヤー: {selected_player}")
@@ -1203,7 +2036,7 @@ def customize():
 
         # DataFrameが st.session_state に存在するか確認
         if "Tier_df" in st.session_state and not st.session_state.Tier_df.empty:
-            tier_list = ["Tier1.0", "Tier1.5", "Tier2.0", "Tier2.5", "Tier3.0", "Tier4.0", "Tier5.0"]
+            tier_list = TIER_COLUMNS
 
             # 列名を取得してセレクトボックスで表示
             selected_column = st.selectbox(
@@ -1259,7 +2092,7 @@ def duel_standby():
 
     ##############################################################################################
     
-    player_list = list(st.session_state.player_df["名前"])
+    player_list = st.session_state.players.names()
     player_list.append("（なし）")
 
     # プレイヤーを選択
@@ -1271,51 +2104,24 @@ def duel_standby():
 
     if not selected_player == "（なし）":
         # 指定プレイヤーのデッキを全て表示(表形式？)
-        # image_namesを取得（安全に抽出）
-        try:
-            image_names_raw = st.session_state.player_df[
-                st.session_state.player_df["名前"] == selected_player
-            ]["image_names"].values[0]
-        except IndexError:
-            st.warning("プレイヤーデータが見つかりません。")
+        image_list = st.session_state.players.decks(selected_player)
 
-        if pd.isna(image_names_raw) or (isinstance(image_names_raw, str) and ast.literal_eval(image_names_raw) == []):
+        if not image_list:
             st.warning("デッキが登録されていません！")
         else:
             st.write(f"{selected_player}のデッキリスト")
-            # image_names をリストに変換（文字列の場合）
-            try:
-                image_list = ast.literal_eval(image_names_raw) if isinstance(image_names_raw, str) else image_names_raw
-                if isinstance(image_list, list) and len(image_list) > 0:
-                    n = 5
-                    for k in range(0, len(image_list), n):
-                        cols = st.columns(n)  # 3つの列を作成
-                        for j, image_name in enumerate(image_list[k:k+n]):
-                            with cols[j]:
-                                output_image(st.session_state.create_df_temp2, image_name, False)
-                else:
-                    st.write("デッキが登録されていません")
-            except Exception as e:
-                st.error(f"画像リストの解析に失敗しました: {e}")
-
-            player_data = st.session_state.player_df[st.session_state.player_df["名前"] == selected_player]
+            n = 5
+            for k in range(0, len(image_list), n):
+                cols = st.columns(n)  # 3つの列を作成
+                for j, image_name in enumerate(image_list[k:k+n]):
+                    with cols[j]:
+                        output_image(image_name, False)
 
             # 使用順の選択肢
             order_options = list(range(1, len(image_list) + 1))
 
-            # 読み込み処理
-            raw_order_data = player_data["deck_order"].values[0]
-
-            # 変換処理（安全な辞書にする）
-            if isinstance(raw_order_data, str):
-                try:
-                    default_order_dict = ast.literal_eval(raw_order_data)
-                except Exception:
-                    default_order_dict = {}
-            elif isinstance(raw_order_data, dict):
-                default_order_dict = raw_order_data
-            else:
-                default_order_dict = {}
+            # 登録済みの使用順
+            default_order_dict = st.session_state.players.deck_order(selected_player)
 
             # 使用順を保存する辞書
             deck_order = {}
@@ -1340,7 +2146,7 @@ def duel_standby():
                     col1, col2 = st.columns([1, 3])
 
                     with col1:
-                        output_image(st.session_state.create_df_temp2, image, False)
+                        output_image(image, False)
 
                     with col2:
                         deck = image.replace(".png", "")
@@ -1357,11 +2163,8 @@ def duel_standby():
                     if len(set(deck_order.values())) < len(deck_order):
                         st.error("使用順が重複しています。異なる順番をすべてのデッキに指定してください。")
                     else:
-                        # 対象プレイヤーの行を更新
-                        st.session_state.player_df.loc[
-                            st.session_state.player_df["名前"] == selected_player, "deck_order"
-                        ] = [deck_order]
-                        st.session_state.player_df.to_csv("player/new_player_list.csv", index=False)
+                        # 対象プレイヤーの使用順を更新
+                        st.session_state.players.set_deck_order(selected_player, deck_order)
                         st.session_state.check_box_disp = False
                         st.session_state.check_box_disp_2 = True
                         st.rerun()
@@ -1372,26 +2175,15 @@ def duel_standby():
 
             check_box_2 = st.checkbox("使用順に並べたデッキを表示", value=st.session_state.check_box_disp_2, key="check_box_2_on")
             if check_box_2:
-                # deck_order を辞書として取り出す（安全に評価）
-                if isinstance(raw_order_data, str):
-                    try:
-                        deck_order = ast.literal_eval(raw_order_data)
-                    except Exception:
-                        deck_order = {}
-                elif isinstance(raw_order_data, dict):
-                    deck_order = raw_order_data
-                else:
-                    deck_order = {}
-
                 # 使用順でソート
-                ordered_decks = sorted(deck_order.items(), key=lambda x: x[1])
+                ordered_decks = sorted(default_order_dict.items(), key=lambda x: x[1])
 
                 for deck_name, order in ordered_decks:
                     col1, col2 = st.columns([1, 1])
                     with col1:
                         st.subheader(f"{order}番目")
                     with col2:
-                        output_image(st.session_state.df, deck_name, False) 
+                        output_image(deck_name, False) 
     
     ##############################################################################################
     st.write("_____________________________________________________________")
@@ -1413,7 +2205,7 @@ def duel_start():
     st.write("_____________________________________________________________")
 
     # プレイヤーを選択
-    player_list = list(st.session_state.player_df["名前"])
+    player_list = st.session_state.players.names()
     col1, col2 = st.columns([1, 1])
 
     with col1:
@@ -1423,9 +2215,8 @@ def duel_start():
             index=player_list.index("PLAYER_1"),
             key="PLAYER_1"
         )   
-        player_data1 = st.session_state.player_df[st.session_state.player_df["名前"] == selected_player1]
-        raw_order_data = player_data1["deck_order"].values[0]
-        if raw_order_data == "{}" or pd.isna(raw_order_data):
+        deck_order = st.session_state.players.deck_order(selected_player1)
+        if not deck_order:
             st.write("❎")
         else:
             st.write("◯")
@@ -1437,9 +2228,8 @@ def duel_start():
             index=player_list.index("PLAYER_2"),
             key="PLAYER_2"
         )   
-        player_data2 = st.session_state.player_df[st.session_state.player_df["名前"] == selected_player2]
-        raw_order_data2 = player_data2["deck_order"].values[0]
-        if raw_order_data2 == "{}" or pd.isna(raw_order_data2):
+        deck_order2 = st.session_state.players.deck_order(selected_player2)
+        if not deck_order2:
             st.write("❎")
         else:
             st.write("◯")
@@ -1472,27 +2262,16 @@ def duel_start():
         else:
             st.subheader(f"第{i}回戦")
             colum1, colum2, colum3 = st.columns([2, 1, 2])
-            if raw_order_data == "{}" or pd.isna(raw_order_data):
+            if not deck_order:
                 st.warning(f"{selected_player1}のデッキ使用順が登録されていません")
-            elif raw_order_data2 == "{}" or pd.isna(raw_order_data2):
+            elif not deck_order2:
                 st.warning(f"{selected_player2}のデッキ使用順が登録されていません")
             else:
                 with colum1:
-                    # deck_order を辞書として取り出す（安全に評価）
-                    if isinstance(raw_order_data, str):
-                        try:
-                            deck_order = ast.literal_eval(raw_order_data)
-                        except Exception:
-                            deck_order = {}
-                    elif isinstance(raw_order_data, dict):
-                        deck_order = raw_order_data
-                    else:
-                        deck_order = {}
-
                     # 使用順でソート
                     ordered_decks = sorted(deck_order.items(), key=lambda x: x[1])
 
-                    output_image(st.session_state.create_df_temp2, ordered_decks[i-1][0]) 
+                    output_image(ordered_decks[i-1][0]) 
 
 
                 with colum2:
@@ -1500,21 +2279,10 @@ def duel_start():
                     st.subheader("VS")
 
                 with colum3:
-                    # deck_order を辞書として取り出す（安全に評価）
-                    if isinstance(raw_order_data2, str):
-                        try:
-                            deck_order2 = ast.literal_eval(raw_order_data2)
-                        except Exception:
-                            deck_order2 = {}
-                    elif isinstance(raw_order_data2, dict):
-                        deck_order2 = raw_order_data2
-                    else:
-                        deck_order2 = {}
-
                     # 使用順でソート
                     ordered_decks2 = sorted(deck_order2.items(), key=lambda x: x[1])
 
-                    output_image(st.session_state.create_df_temp2, ordered_decks2[i-1][0]) 
+                    output_image(ordered_decks2[i-1][0]) 
 
                 st.session_state.winner[i-1] = st.radio(f"第{i}回戦 勝者", [selected_player1, selected_player2], horizontal=True, key=f"winner_{i}")
                 
@@ -1524,29 +2292,36 @@ def duel_start():
     #     st.session_state.match_results = []
     # まとめて記録ボタン
     if st.button("結果を登録する"):
+        # 今日の日付を取得
+        today = date.today()
+
+        # 文字列に変換（例：2025-06-04）
+        date_str = today.strftime("%Y-%m-%d")
+
         st.session_state.results = []
         for i in range(1, n + 1):
             winner = st.session_state.winner[i-1]
             if winner is not None:
                 st.session_state.results.append({
+                        "date": date_str,
+                        "round": i,
                         "player1": selected_player1,
-                        "deck1": ordered_decks[i-1][0],
+                        "deck1": normalize_deck_name(ordered_decks[i-1][0]),
                         "player2": selected_player2,
-                        "deck2": ordered_decks2[i-1][0],
+                        "deck2": normalize_deck_name(ordered_decks2[i-1][0]),
                         "winner": st.session_state.winner[i-1]
                     })
 
-            
-        # st.session_state.match_results.extend(st.session_state.results)
-        st.success("結果を登録しました。")
+        # 対戦記録に追記
+        try:
+            append_matches(st.session_state.results)
+        except sqlite3.Error as e:
+            st.error(f"対戦記録の保存に失敗しました: {e}")
+        else:
+            st.success("結果を登録しました。")
         # st.dataframe(pd.DataFrame(st.session_state.match_results))
         results_df = pd.DataFrame(st.session_state.results)
         st.dataframe(results_df)
-        # 今日の日付を取得
-        today = date.today()
-
-        # 文字列に変換（例：2025-06-04）
-        date_str = today.strftime("%Y-%m-%d")
 
         file_name_input = "GRADES_DF_" + date_str
 
@@ -1559,6 +2334,481 @@ def duel_start():
         st.session_state.page_id = "デュエル"
         st.session_state.page_id_flag = True
         st.rerun()
+# 成績ファイルの列
+GRADE_COLUMNS = ["player1", "deck1", "player2", "deck2", "winner"]
+
+# 対戦記録（追記のみ）。プレイヤーと日付に索引を付ける
+MATCH_LOG_DB = "player/match_log.sqlite3"
+
+@st.cache_resource
+def match_log_store():
+    return {"lock": threading.Lock(), "initialized": set()}
+
+def connect_match_log(path=MATCH_LOG_DB):
+    store = match_log_store()
+    conn = sqlite3.connect(path, timeout=30)
+    if path not in store["initialized"]:
+        with store["lock"]:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS matches (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    date TEXT NOT NULL,
+                    round INTEGER,
+                    player1 TEXT NOT NULL,
+                    deck1 TEXT,
+                    player2 TEXT NOT NULL,
+                    deck2 TEXT,
+                    winner TEXT,
+                    recorded_at TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS matches_player1 ON matches (player1, date);
+                CREATE INDEX IF NOT EXISTS matches_player2 ON matches (player2, date);
+                CREATE INDEX IF NOT EXISTS matches_date ON matches (date);
+            """)
+            store["initialized"].add(path)
+    return conn
+
+# 対戦結果を追記する
+def append_matches(results, path=MATCH_LOG_DB):
+    recorded_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+    rows = [
+        (r["date"], r.get("round"), r["player1"], r["deck1"], r["player2"], r["deck2"], r["winner"], recorded_at)
+        for r in results
+    ]
+    conn = connect_match_log(path)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT INTO matches (date, round, player1, deck1, player2, deck2, winner, recorded_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+    finally:
+        conn.close()
+
+# 対戦記録を取得する（プレイヤー・期間で絞り込み、記録順）
+def query_matches(player=None, date_from=None, date_to=None, path=MATCH_LOG_DB):
+    conditions = []
+    params = []
+    if player is not None:
+        conditions.append("(player1 = ? OR player2 = ?)")
+        params += [player, player]
+    if date_from is not None:
+        conditions.append("date >= ?")
+        params.append(str(date_from))
+    if date_to is not None:
+        conditions.append("date <= ?")
+        params.append(str(date_to))
+    sql = "SELECT date, round, player1, deck1, player2, deck2, winner FROM matches"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY id"
+
+    conn = connect_match_log(path)
+    try:
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+
+# 指定したidより後に記録された対戦（レーティングの差分更新用）
+def query_matches_after(after_id=0, path=MATCH_LOG_DB):
+    conn = connect_match_log(path)
+    try:
+        return pd.read_sql_query(
+            "SELECT id, player1, deck1, player2, deck2, winner FROM matches WHERE id > ? ORDER BY id",
+            conn,
+            params=[after_id],
+        )
+    finally:
+        conn.close()
+
+# Eloレーティングの初期値と1試合あたりの変動の大きさ
+ELO_INITIAL = 1500.0
+ELO_K = 32.0
+
+# プレイヤーとデッキのEloレーティング
+class EloRatings:
+    def __init__(self):
+        self.ratings = {"player": {}, "deck": {}}
+        self.games = {"player": {}, "deck": {}}
+        self.last_id = 0
+
+    # 1試合分を反映する（勝者がどちらでもない対戦と、同じ名前同士は数えない）
+    def update(self, player1, deck1, player2, deck2, winner):
+        if winner == player1:
+            score = 1.0
+        elif winner == player2:
+            score = 0.0
+        else:
+            return
+        for kind, a, b in (("player", player1, player2), ("deck", deck1, deck2)):
+            if not a or not b or pd.isna(a) or pd.isna(b) or a == b:
+                continue
+            ratings = self.ratings[kind]
+            games = self.games[kind]
+            ra = ratings.get(a, ELO_INITIAL)
+            rb = ratings.get(b, ELO_INITIAL)
+            delta = ELO_K * (score - 1.0 / (1.0 + 10.0 ** ((rb - ra) / 400.0)))
+            ratings[a] = ra + delta
+            ratings[b] = rb - delta
+            games[a] = games.get(a, 0) + 1
+            games[b] = games.get(b, 0) + 1
+
+    # 対戦記録に追加された分だけ反映する
+    def apply(self, matches):
+        for match_id, player1, deck1, player2, deck2, winner in matches[["id", "player1", "deck1", "player2", "deck2", "winner"]].itertuples(index=False):
+            self.update(player1, normalize_deck_name(deck1) if isinstance(deck1, str) else deck1, player2, normalize_deck_name(deck2) if isinstance(deck2, str) else deck2, winner)
+            self.last_id = match_id
+
+    # 対戦記録全体から作り直す
+    # Eloは順番に依存するので、名前を整数に置き換えた配列の上で1回だけ順に計算する
+    @classmethod
+    def rebuild(cls, matches):
+        elo = cls()
+        if matches.empty:
+            return elo
+        player1 = matches["player1"].to_numpy(dtype=object)
+        player2 = matches["player2"].to_numpy(dtype=object)
+        winner = matches["winner"].to_numpy(dtype=object)
+        score = np.where(winner == player1, 1.0, np.where(winner == player2, 0.0, np.nan))
+        decks1 = matches["deck1"].map(normalize_deck_name, na_action="ignore").to_numpy(dtype=object)
+        decks2 = matches["deck2"].map(normalize_deck_name, na_action="ignore").to_numpy(dtype=object)
+
+        for kind, a_values, b_values in (("player", player1, player2), ("deck", decks1, decks2)):
+            codes, names = pd.factorize(np.concatenate([a_values, b_values]))
+            a_codes, b_codes = codes[:len(a_values)], codes[len(a_values):]
+            valid = (a_codes >= 0) & (b_codes >= 0) & (a_codes != b_codes) & ~np.isnan(score)
+            ratings = np.full(len(names), ELO_INITIAL)
+            games = np.bincount(np.concatenate([a_codes[valid], b_codes[valid]]), minlength=len(names))
+            for a, b, s in zip(a_codes[valid].tolist(), b_codes[valid].tolist(), score[valid].tolist()):
+                delta = ELO_K * (s - 1.0 / (1.0 + 10.0 ** ((ratings[b] - ratings[a]) / 400.0)))
+                ratings[a] += delta
+                ratings[b] -= delta
+            played = games > 0
+            elo.ratings[kind] = dict(zip(names[played], ratings[played].tolist()))
+            elo.games[kind] = dict(zip(names[played], games[played].tolist()))
+
+        if "id" in matches.columns:
+            elo.last_id = int(matches["id"].max())
+        return elo
+
+    # レーティング順の一覧
+    def ranking(self, kind):
+        ranking = pd.DataFrame({
+            "レーティング": pd.Series(self.ratings[kind], dtype=float).round(1),
+            "対戦数": pd.Series(self.games[kind], dtype=int),
+        })
+        ranking = ranking.sort_values("レーティング", ascending=False)
+        ranking.insert(0, "順位", range(1, len(ranking) + 1))
+        return ranking
+
+# 全セッションで共有するレーティング（対戦記録の追加分だけ更新する）
+@st.cache_resource
+def elo_store():
+    return {"lock": threading.Lock(), "elo": None}
+
+def get_elo_ratings():
+    store = elo_store()
+    with store["lock"]:
+        if store["elo"] is None:
+            store["elo"] = EloRatings.rebuild(query_matches_after(0))
+        else:
+            store["elo"].apply(query_matches_after(store["elo"].last_id))
+        return store["elo"]
+
+# デッキ同士の勝敗数（対戦したことのある組だけを持つ）
+# Tierの見直しの相性表もここから作る
+class MatchupStore:
+    def __init__(self):
+        # デッキ → {相手のデッキ → [勝ち, 負け]}
+        self.counts = {}
+        self.last_id = 0
+
+    @classmethod
+    def from_results(cls, results):
+        store = cls()
+        store.add_results(results)
+        return store
+
+    def update(self, deck1, deck2, deck1_won):
+        if not isinstance(deck1, str) or not isinstance(deck2, str) or deck1 == deck2:
+            return
+        record1 = self.counts.setdefault(deck1, {}).setdefault(deck2, [0, 0])
+        record2 = self.counts.setdefault(deck2, {}).setdefault(deck1, [0, 0])
+        if deck1_won:
+            record1[0] += 1
+            record2[1] += 1
+        else:
+            record1[1] += 1
+            record2[0] += 1
+
+    # deck_results()の縦長の対戦結果（1対戦2行）をまとめて反映する
+    def add_results(self, results):
+        grouped = results.groupby(["デッキ", "相手のデッキ"])["勝ち"].agg(["sum", "count"])
+        for (deck, opponent), wins, games in zip(grouped.index, grouped["sum"], grouped["count"]):
+            record = self.counts.setdefault(deck, {}).setdefault(opponent, [0, 0])
+            record[0] += int(wins)
+            record[1] += int(games - wins)
+
+    # 対戦記録に追加された分だけ反映する
+    def apply(self, matches):
+        if matches.empty:
+            return
+        self.add_results(deck_results(matches))
+        self.last_id = int(matches["id"].max())
+
+    # deckから見た相手との (勝ち, 負け)
+    def record(self, deck, opponent):
+        return tuple(self.counts.get(deck, {}).get(opponent, (0, 0)))
+
+    # deckに勝ち越している相手（相手から見た勝率の高い順）
+    def counters(self, deck, min_games=1, top=5):
+        candidates = [
+            (opponent, losses / (wins + losses), wins + losses)
+            for opponent, (wins, losses) in self.counts.get(deck, {}).items()
+            if wins + losses >= min_games
+        ]
+        return heapq.nlargest(top, candidates, key=lambda item: (item[1], item[2]))
+
+    # 指定したデッキ同士の勝率（対戦したことのある組だけ）
+    def to_long(self, decks):
+        decks = set(decks)
+        rows = [
+            (deck, opponent, wins / (wins + losses), wins + losses)
+            for deck in decks
+            for opponent, (wins, losses) in self.counts.get(deck, {}).items()
+            if opponent in decks
+        ]
+        return pd.DataFrame(rows, columns=["デッキ", "相手のデッキ", "勝率", "対戦数"])
+
+    # 行のデッキから見た勝率と対戦数の表（decksを省略すると全デッキ）
+    def matrices(self, decks=None):
+        long_df = self.to_long(self.counts if decks is None else decks)
+        win_rate = long_df.pivot(index="デッキ", columns="相手のデッキ", values="勝率")
+        games = long_df.pivot(index="デッキ", columns="相手のデッキ", values="対戦数").fillna(0).astype(int)
+        return win_rate, games
+
+# 全セッションで共有する相性表（対戦記録の追加分だけ更新する）
+@st.cache_resource
+def matchup_store():
+    return {"lock": threading.Lock(), "matchups": MatchupStore()}
+
+def get_matchups():
+    store = matchup_store()
+    with store["lock"]:
+        matchups = store["matchups"]
+        matchups.apply(query_matches_after(matchups.last_id))
+        return matchups
+
+# デッキ相性（苦手な相手と、色・タイトルで絞ったヒートマップ）
+def matchup_view():
+    st.subheader("デッキ相性（対戦記録から算出）")
+    try:
+        matchups = get_matchups()
+    except sqlite3.Error as e:
+        st.error(f"対戦記録の読み込みに失敗しました: {e}")
+        return
+    if not matchups.counts:
+        st.info("対戦記録がありません。")
+        return
+
+    selected_deck = st.selectbox("デッキを選択してください", sorted(matchups.counts), key="matchup_deck")
+    counters = matchups.counters(selected_deck, top=10)
+    st.write(f"{selected_deck} が苦手な相手")
+    st.dataframe(pd.DataFrame(
+        [(opponent, round(rate, 3), games) for opponent, rate, games in counters],
+        columns=["相手のデッキ", "相手の勝率", "対戦数"],
+    ))
+
+    catalog = get_deck_catalog()["catalog"]
+    select_filter = st.radio("ヒートマップの絞り込み", ["色", "タイトル"], horizontal=True, key="matchup_filter")
+    options = sorted(catalog[select_filter].dropna().unique())
+    selected_value = st.selectbox(select_filter, options, key="matchup_filter_value")
+    decks = catalog.loc[catalog[select_filter] == selected_value, "デッキ名"]
+    long_df = matchups.to_long(decks)
+    if long_df.empty:
+        st.info("該当するデッキ同士の対戦記録はありません。")
+        return
+
+    chart = alt.Chart(long_df).mark_rect().encode(
+        x=alt.X("相手のデッキ:N"),
+        y=alt.Y("デッキ:N"),
+        color=alt.Color("勝率:Q", scale=alt.Scale(domain=[0, 1], scheme="redblue")),
+        tooltip=["デッキ", "相手のデッキ", alt.Tooltip("勝率:Q", format=".2f"), "対戦数"],
+    )
+    st.altair_chart(chart, use_container_width=True)
+
+# Tierの見直しに必要な最少対戦数（提案するTierはTIER_LEVELSのどれか）
+TIER_MIN_GAMES = 10
+# 見直し後のTier_List（そのまま置き換えられる形式）の出力先
+TIER_CANDIDATE_DIR = "cache/tier_candidates"
+
+# 対戦記録を「デッキ, 相手のデッキ, 勝ち」の縦長の形にする（1対戦2行）
+def deck_results(matches):
+    deck1 = matches["deck1"].astype(object).map(normalize_deck_name, na_action="ignore")
+    deck2 = matches["deck2"].astype(object).map(normalize_deck_name, na_action="ignore")
+    winner = matches["winner"].astype(object)
+    decided = (winner == matches["player1"].astype(object)) | (winner == matches["player2"].astype(object))
+    win1 = (winner == matches["player1"].astype(object))
+    results = pd.DataFrame({
+        "デッキ": pd.concat([deck1, deck2], ignore_index=True),
+        "相手のデッキ": pd.concat([deck2, deck1], ignore_index=True),
+        "勝ち": pd.concat([win1, ~win1], ignore_index=True),
+    })
+    keep = pd.concat([decided, decided], ignore_index=True) & results["デッキ"].notna() & results["相手のデッキ"].notna()
+    return results[keep & (results["デッキ"] != results["相手のデッキ"])]
+
+# 勝率のWilsonスコア信頼区間（z=1.96で95%）
+def wilson_interval(wins, games, z=1.96):
+    wins = np.asarray(wins, dtype=float)
+    games = np.asarray(games, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = wins / games
+        denominator = 1 + z ** 2 / games
+        center = (p + z ** 2 / (2 * games)) / denominator
+        half = z * np.sqrt(p * (1 - p) / games + z ** 2 / (4 * games ** 2)) / denominator
+    return center - half, center + half
+
+# デッキごとの対戦数・勝率・信頼区間
+def deck_win_rates(results):
+    stats = results.groupby("デッキ")["勝ち"].agg(対戦数="count", 勝ち="sum")
+    stats["勝率"] = stats["勝ち"] / stats["対戦数"]
+    stats["下限"], stats["上限"] = wilson_interval(stats["勝ち"], stats["対戦数"])
+    return stats
+
+# デッキ同士の相性表（行のデッキから見た勝率と対戦数）
+def matchup_matrix(results):
+    return MatchupStore.from_results(results).matrices()
+
+# 信頼区間の下限の順位で、対戦数が足りるデッキにTierを割り当てる
+# 各Tierの割合は現在のTierの割合に合わせる（Tier1.0が最も強い）
+def propose_tiers(stats, min_games=TIER_MIN_GAMES):
+    stats = stats.copy()
+    stats["現在のTier"] = tiers_of_decks(stats.index.to_series()).to_numpy()
+    stats["提案Tier"] = np.nan
+    rated = stats["対戦数"] >= min_games
+    if not rated.any():
+        return stats
+
+    current = stats.loc[rated, "現在のTier"].dropna()
+    if current.empty:
+        shares = np.full(len(TIER_LEVELS), 1 / len(TIER_LEVELS))
+    else:
+        nearest = np.abs(current.to_numpy()[:, None] - np.array(TIER_LEVELS)[None, :]).argmin(axis=1)
+        shares = np.bincount(nearest, minlength=len(TIER_LEVELS)) / len(nearest)
+    boundaries = np.cumsum(shares)
+
+    # 強い順の位置（0〜1）が入る区間のTier
+    position = (stats.loc[rated, "下限"].rank(ascending=False, method="first") - 0.5) / rated.sum()
+    bucket = np.minimum(np.searchsorted(boundaries, position.to_numpy()), len(TIER_LEVELS) - 1)
+    stats.loc[rated, "提案Tier"] = np.array(TIER_LEVELS)[bucket]
+    return stats
+
+# 現在のTier_Listの提案Tierを書き換えたcsvを出力先に書き出し、パスを返す
+def write_tier_candidates(proposal, tier_dir="Tier_List", output_dir=TIER_CANDIDATE_DIR):
+    proposed = proposal["提案Tier"].dropna()
+    paths = []
+    for path in tier_list_paths(tier_dir):
+        try:
+            df = pd.read_csv(path)
+        except FileNotFoundError:
+            continue
+        names = df["デッキ名"].map(lambda name: normalize_deck_name(name) if isinstance(name, str) else name)
+        new_tier = names.map(proposed)
+        tiers = new_tier.where(new_tier.notna(), df["Tier"])
+        # 元のcsvと同じく整数のTierは「3」のように書く
+        df["Tier"] = tiers.map(lambda tier: f"{float(tier):g}", na_action="ignore")
+        candidate_path = os.path.join(output_dir, os.path.basename(path))
+        write_file_atomic(candidate_path, df.to_csv(index=False).encode("utf-8-sig"))
+        paths.append(candidate_path)
+    return paths
+
+# 対戦記録からTierを見直す
+def tier_recalibration_view():
+    st.subheader("対戦結果からTierを見直す")
+    try:
+        matches = query_matches()
+    except sqlite3.Error as e:
+        st.error(f"対戦記録の読み込みに失敗しました: {e}")
+        return
+    results = deck_results(matches)
+    if results.empty:
+        st.info("対戦記録がありません。")
+        return
+
+    min_games = st.number_input("見直しに必要な対戦数", min_value=1, value=TIER_MIN_GAMES, step=1)
+    proposal = propose_tiers(deck_win_rates(results), int(min_games))
+    changed = proposal[proposal["提案Tier"].notna() & (proposal["提案Tier"] != proposal["現在のTier"])]
+    st.write(f"対戦記録 {len(matches)} 件、デッキ {len(proposal)} 種（Tierを変更する提案 {len(changed)} 件）")
+    st.dataframe(proposal.sort_values("下限", ascending=False).round(3))
+
+    with st.expander("デッキ相性表（行のデッキから見た勝率）"):
+        win_rate, games = matchup_matrix(results)
+        rated = proposal.index[proposal["対戦数"] >= min_games]
+        st.dataframe(win_rate.reindex(index=rated, columns=rated).round(2))
+
+    if st.button("Tier_Listの候補を作成"):
+        paths = write_tier_candidates(proposal)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+            for path in paths:
+                zf.write(path, os.path.basename(path))
+        st.success(f"{len(paths)} 件の候補を作成しました（{TIER_CANDIDATE_DIR}）")
+        st.download_button("候補をダウンロード", data=buffer.getvalue(), file_name="Tier_List_candidates.zip", mime="application/zip")
+
+# 成績のcsvを型付きの列にする（プレイヤーとデッキはカテゴリ型）
+def grades_from_df(df):
+    missing = [col for col in GRADE_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"成績ファイルに列がありません: {', '.join(missing)}")
+    grades = df.copy()
+    for col in ("deck1", "deck2"):
+        grades[col] = grades[col].map(normalize_deck_name, na_action="ignore")
+    for col in GRADE_COLUMNS:
+        grades[col] = grades[col].astype("category")
+    return grades
+
+# 内容のハッシュごとに解析結果をキャッシュする（同じファイルは再解析しない）
+@st.cache_data(max_entries=16, show_spinner=False)
+def parse_grades_csv(content_hash, _data):
+    return grades_from_df(pd.read_csv(io.BytesIO(_data), dtype=str))
+
+def load_grades(data):
+    return parse_grades_csv(hashlib.sha1(data).hexdigest(), data)
+
+# プレイヤーから見た対戦記録（自分のデッキ, 対戦相手, 相手のデッキ, 勝ち）
+def grades_of_player(grades, player):
+    is_player1 = (grades["player1"] == player).to_numpy()
+    is_player2 = (grades["player2"] == player).to_numpy()
+    rows = grades[is_player1 | is_player2]
+    first = is_player1[is_player1 | is_player2]
+    view = pd.DataFrame({
+        "自分のデッキ": np.where(first, rows["deck1"].astype(object), rows["deck2"].astype(object)),
+        "対戦相手": np.where(first, rows["player2"].astype(object), rows["player1"].astype(object)),
+        "相手のデッキ": np.where(first, rows["deck2"].astype(object), rows["deck1"].astype(object)),
+        "勝ち": (rows["winner"].astype(object) == player).to_numpy(),
+    }, index=rows.index)
+    for col in ("自分のデッキ", "対戦相手", "相手のデッキ"):
+        view[col] = view[col].astype("category")
+    return view
+
+# 指定した列ごとの勝敗数と勝率
+def summarize_grades(view, keys):
+    summary = view.groupby(keys, observed=True)["勝ち"].agg(対戦数="count", 勝ち="sum")
+    summary["負け"] = summary["対戦数"] - summary["勝ち"]
+    summary["勝率"] = (summary["勝ち"] / summary["対戦数"]).round(3)
+    return summary
+
+# 対戦記録にデッキの色とTierを付ける
+def with_deck_attributes(view):
+    catalog = get_deck_catalog()["catalog"].drop_duplicates("デッキ名").set_index("デッキ名")
+    view = view.copy()
+    view["自分の色"] = view["自分のデッキ"].astype(object).map(catalog["色"])
+    view["自分のTier"] = tiers_of_decks(view["自分のデッキ"].astype(object)).to_numpy()
+    view["相手のTier"] = tiers_of_decks(view["相手のデッキ"].astype(object)).to_numpy()
+    return view
+
 # 対戦成績
 def duel_grades():
     st.title("対戦成績照会")
@@ -1568,22 +2818,43 @@ def duel_grades():
         st.rerun()
 
     st.write("_____________________________________________________________")
-    uploaded_file = st.file_uploader("CSVファイルをアップロードしてください", type="csv")
+    select_source = st.radio("成績の読み込み元", ["対戦記録", "CSVファイル"], horizontal=True)
+    uploaded_file = None
+    if select_source == "CSVファイル":
+        uploaded_file = st.file_uploader("CSVファイルをアップロードしてください", type="csv")
     # プレイヤー選択
     selected_player = st.selectbox(
         label="プレイヤーを選択してください",
-        options=st.session_state.player_df["名前"],
+        options=st.session_state.players.names(),
         key="player"
     )
     # 表示件数選択
     output_num_list = [10,20,30,50]
     selected_output_num = st.selectbox("表示件数",output_num_list)
 
-    if uploaded_file is not None:
-        df = pd.read_csv(uploaded_file)
+    grades = None
+    if select_source == "対戦記録":
+        # 期間で絞り込み（未指定なら全期間）
+        period = st.date_input("期間", value=(), key="grades_period")
+        date_from = period[0] if len(period) > 0 else None
+        date_to = period[1] if len(period) > 1 else date_from
+        try:
+            grades = grades_from_df(query_matches(selected_player, date_from, date_to))
+        except sqlite3.Error as e:
+            st.error(f"対戦記録の読み込みに失敗しました: {e}")
+            st.stop()
+    elif uploaded_file is not None:
+        try:
+            grades = load_grades(uploaded_file.getvalue())
+        except ValueError as e:
+            st.error(e)
+            st.stop()
+
+    if grades is not None:
 
         # 該当プレイヤーが player1 または player2 に含まれる行を抽出
-        filtered_df = df[(df["player1"] == selected_player) | (df["player2"] == selected_player)]
+        filtered_df = grades[(grades["player1"] == selected_player) | (grades["player2"] == selected_player)]
+        view = grades_of_player(grades, selected_player)
 
         # 表示件数分だけ表示
         st.write(f"🔍 {selected_player} の対戦記録（最大 {selected_output_num} 件表示）")
@@ -1599,59 +2870,151 @@ def duel_grades():
             #############################################################################
 
         # 勝敗を集計
-        win_counts = {}
-        for _, row in filtered_df.iterrows():
-            opponent = row["player2"] if row["player1"] == selected_player else row["player1"]
-            is_win = (row["winner"] == selected_player)
-
-            if opponent not in win_counts:
-                win_counts[opponent] = {"自分の勝ち": 0, "相手の勝ち": 0}
-
-            if is_win:
-                win_counts[opponent]["自分の勝ち"] += 1
-            else:
-                win_counts[opponent]["相手の勝ち"] += 1
-
-        # 集計結果をデータフレームにして表示
-        summary_df = pd.DataFrame([
-            {"対戦相手": opponent, **result}
-            for opponent, result in win_counts.items()
-        ])
+        summary_df = summarize_grades(view, "対戦相手")
 
         st.write(f"📊 {selected_player} の対戦相手ごとの勝敗数")
-        for player in summary_df["対戦相手"]:
-            my_win_num = summary_df[summary_df["対戦相手"]==player]["自分の勝ち"].values[0]
-            opponent_win_num = summary_df[summary_df["対戦相手"]==player]["相手の勝ち"].values[0]
+        for player, my_win_num, opponent_win_num in zip(summary_df.index, summary_df["勝ち"], summary_df["負け"]):
             st.header(f"{selected_player} ー {player} 　:　 {my_win_num}　ー　{opponent_win_num}")
         # st.dataframe(summary_df)
 
+        if not view.empty:
+            view = with_deck_attributes(view)
+            tab_deck, tab_color, tab_tier = st.tabs(["デッキ別", "色別", "Tier対戦別"])
+            with tab_deck:
+                st.dataframe(summarize_grades(view, "自分のデッキ").sort_values("対戦数", ascending=False))
+            with tab_color:
+                st.dataframe(summarize_grades(view, "自分の色"))
+            with tab_tier:
+                st.write("行：自分のTier　列：相手のTier　値：勝率")
+                st.dataframe(summarize_grades(view, ["自分のTier", "相手のTier"])["勝率"].unstack())
+
     else:
         st.info("CSVファイルをアップロードしてください。")
 
+    st.write("_____________________________________________________________")
+    st.subheader("レーティング（対戦記録から算出）")
+    try:
+        elo = get_elo_ratings()
+    except sqlite3.Error as e:
+        st.error(f"対戦記録の読み込みに失敗しました: {e}")
+    else:
+        tab_player, tab_deck = st.tabs(["プレイヤー", "デッキ"])
+        with tab_player:
+            st.dataframe(elo.ranking("player"))
+        with tab_deck:
+            deck_ranking = elo.ranking("deck")
+            deck_ranking["Tier"] = tiers_of_decks(deck_ranking.index.to_series()).to_numpy()
+            st.dataframe(deck_ranking)
+
+    st.write("_____________________________________________________________")
+    matchup_view()
 
     st.write("_____________________________________________________________")
     if st.button("戻る"):
         st.session_state.page_id = "デュエル"
         st.session_state.page_id_flag = True
         st.rerun()
+# 成績ファイルを結合するときに一度に読み込む行数
+GRADES_CHUNK_SIZE = 5000
+# 結合後の列
+MERGED_GRADE_COLUMNS = ["date", "round"] + GRADE_COLUMNS
+
+# 対戦を見分けるキー（日付, 回戦, プレイヤー, デッキ）のハッシュ
+# 日付か回戦がない行（古いファイル）は別の日の対戦と区別できないので、キーを作らない（None）
+def match_keys(chunk):
+    keys = []
+    columns = [chunk[col].tolist() for col in MERGED_GRADE_COLUMNS[:-1]]
+    for date_value, round_value, player1, deck1, player2, deck2 in zip(*columns):
+        if not date_value or not round_value:
+            keys.append(None)
+            continue
+        key = (date_value, round_value, player1, normalize_deck_name(deck1) if deck1 else deck1, player2, normalize_deck_name(deck2) if deck2 else deck2)
+        keys.append(hashlib.sha1("\x1f".join(map(str, key)).encode("utf-8")).digest())
+    return keys
+
+# ファイル内容のハッシュ（同じファイルを2回結合しないため）
+def file_content_hash(file):
+    digest = hashlib.sha1()
+    for block in iter(lambda: file.read(1 << 20), b""):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+# 成績ファイルを少しずつ読み込み、重複を除いてcsvに書き出す
+# 日付と回戦のある行はキーで重複を除き、内容が同じファイルはまるごと飛ばす
+# 読み込みに失敗したファイルは、途中まで読んだ行も含めて結果に入れない
+def merge_grade_files(files, chunksize=GRADES_CHUNK_SIZE, preview_rows=100):
+    buffer = io.BytesIO()
+    buffer.write(",".join(MERGED_GRADE_COLUMNS).encode("utf-8-sig") + b"\n")
+    seen = set()
+    seen_files = set()
+    stats = {"files": 0, "rows": 0, "duplicates": 0, "skipped_files": 0}
+    preview = []
+    preview_count = 0
+    for file in files:
+        try:
+            content_hash = file_content_hash(file)
+            if content_hash in seen_files:
+                stats["skipped_files"] += 1
+                continue
+
+            # ファイル全体を読み終えるまでは結果に反映しない
+            staged_data = []
+            staged_keys = set()
+            staged_preview = []
+            staged_preview_count = 0
+            rows = 0
+            duplicates = 0
+            reader = pd.read_csv(file, chunksize=chunksize, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+            for chunk in reader:
+                missing = [col for col in GRADE_COLUMNS if col not in chunk.columns]
+                if missing:
+                    raise ValueError(f"列がありません: {', '.join(missing)}")
+                chunk = chunk.reindex(columns=MERGED_GRADE_COLUMNS, fill_value="")
+                keep = []
+                for key in match_keys(chunk):
+                    if key is None:
+                        keep.append(True)
+                    else:
+                        keep.append(key not in seen and key not in staged_keys)
+                        staged_keys.add(key)
+                rows += len(chunk)
+                duplicates += keep.count(False)
+                chunk = chunk[keep]
+                staged_data.append(chunk.to_csv(header=False, index=False).encode("utf-8"))
+                if preview_count + staged_preview_count < preview_rows:
+                    staged_preview.append(chunk.head(preview_rows - preview_count - staged_preview_count))
+                    staged_preview_count += len(staged_preview[-1])
+        except Exception as e:
+            st.error(f"{file.name} の読み込みに失敗しました: {e}")
+            continue
+
+        for data in staged_data:
+            buffer.write(data)
+        seen |= staged_keys
+        seen_files.add(content_hash)
+        preview += staged_preview
+        preview_count += staged_preview_count
+        stats["files"] += 1
+        stats["rows"] += rows
+        stats["duplicates"] += duplicates
+
+    preview_df = pd.concat(preview, ignore_index=True) if preview else pd.DataFrame(columns=MERGED_GRADE_COLUMNS)
+    return buffer.getvalue(), stats, preview_df
+
 # 成績の結合
 def combine_grades():
     st.title("成績ファイル結合")
     uploaded_files = st.file_uploader("CSVファイルを複数選択", type="csv", accept_multiple_files=True)
     
     if uploaded_files:
-        all_dfs = []
-        for file in uploaded_files:
-            try:
-                df = pd.read_csv(file)
-                all_dfs.append(df)
-            except Exception as e:
-                st.error(f"{file.name} の読み込みに失敗しました: {e}")
+        csv_data, stats, preview_df = merge_grade_files(uploaded_files)
 
-        if all_dfs:
-            combined_df = pd.concat(all_dfs, ignore_index=True)
-            st.success(f"{len(all_dfs)} 件のファイルを結合しました。")
-            st.dataframe(combined_df)
+        if stats["files"] > 0:
+            st.success(f"{stats['files']} 件のファイルを結合しました。（{stats['rows']} 件中、重複 {stats['duplicates']} 件を除外）")
+            if stats["skipped_files"] > 0:
+                st.info(f"内容が同じファイル {stats['skipped_files']} 件は結合しませんでした。")
+            st.dataframe(preview_df)
 
             # 今日の日付を取得
             today = date.today()
@@ -1661,8 +3024,12 @@ def combine_grades():
 
             file_name_input = "COMBINE_GRADES_DF_" + date_str
 
-            if file_name_input != "":
-                download_dataframe_as_csv(file_name_input, combined_df)
+            st.download_button(
+                label="CSVファイルをダウンロード",
+                data=csv_data,
+                file_name=file_name_input + ".csv",
+                mime="text/csv"
+            )
             
             st.write("ダウンロード後、結合前ファイルの削除を推奨")
 
@@ -1672,82 +3039,313 @@ def combine_grades():
         st.session_state.page_id_flag = True
         st.rerun()
 
-# 画像を5*5にまとめる
-def combine_images(image_names, grid_size=(5, 5), padding=10, bg_color=(255, 255, 255, 255)):
-    """
-    画像名リストから5x5グリッド画像を作成。
-    各画像の上下左右に余白を付け、背景色を指定可能。
-    """
-    color_folders = ["image/赤", "image/青", "image/緑", "image/黄", "image/紫"]
-    images = []
-
-    for image_name in image_names:
-        found_path = None
-
-        image_name = image_name + ".png"
-        
-        for folder in color_folders:
-            img_path = os.path.join(folder, image_name)
-            if os.path.exists(img_path):
-                found_path = img_path
-                break
-
-        if found_path is None:
-            st.error(f"画像ファイルが見つかりません: {image_name}")
-            continue
-
-        try:
-            img = Image.open(found_path).convert("RGBA")
-            images.append(img)
-        except Exception as e:
-            st.error(f"画像の読み込みに失敗しました: {image_name} ({e})")
-
-    if not images:
+# 合成用に読み込んだ画像を保持する数
+BINGO_TILE_CACHE_SIZE = 256
+
+# 合成用の画像（RGBAに変換し、マスの大きさに縮小済み）。全セッションで共有し、古いものから捨てる
+@st.cache_resource(max_entries=BINGO_TILE_CACHE_SIZE, show_spinner=False)
+def load_bingo_tile(path, content_hash, size):
+    img = Image.open(path).convert("RGBA")
+    if img.size != size:
+        img = img.resize(size, Image.LANCZOS)
+    return img
+
+# 画像名リストごとのボードを1枚のキャンバスに直接並べる
+# マスの大きさは最初に見つかった画像の大きさに合わせる（tile_widthを指定すると縮小画像から作る）
+def compose_bingo_boards(boards, grid_size=(5, 5), padding=10, bg_colors=((255, 255, 255),), space=50, tile_width=None):
+    manifest = get_image_manifest()
+    entries = []
+    for image_names in boards:
+        board_entries = []
+        for image_name in image_names:
+            entry = manifest.get(normalize_deck_name(image_name))
+            if entry is None:
+                st.error(f"画像ファイルが見つかりません: {normalize_deck_name(image_name)}.png")
+                continue
+            board_entries.append(entry)
+        entries.append(board_entries)
+
+    first = next((board[0] for board in entries if board), None)
+    if first is None:
         st.error("有効な画像が1つも見つかりませんでした。")
         return None
 
-    # 1枚目の画像サイズを基準にする
-    w, h = images[0].size
+    w, h = first["width"], first["height"]
+    if tile_width is not None and tile_width < w:
+        w, h = tile_width, max(1, round(h * tile_width / w))
     grid_w, grid_h = grid_size
+    board_width = w * grid_w + padding * (grid_w + 1)
+    board_height = h * grid_h + padding * (grid_h + 1)
+
+    # 1枚のキャンバスに背景を塗り、透過を背景と合成しながら貼り付ける
+    canvas = Image.new("RGB", (board_width * len(boards) + space * (len(boards) - 1), board_height), (255, 255, 255))
+    for b, board_entries in enumerate(entries):
+        left = b * (board_width + space)
+        bg_color = tuple(bg_colors[b % len(bg_colors)][:3])
+        canvas.paste(bg_color, (left, 0, left + board_width, board_height))
+        for idx, entry in enumerate(board_entries[:grid_w * grid_h]):
+            try:
+                path = entry["path"] if tile_width is None else get_thumbnail(entry, w)
+                tile = load_bingo_tile(path, entry["hash"], (w, h))
+            except Exception as e:
+                st.error(f"画像の読み込みに失敗しました: {entry['path']} ({e})")
+                continue
+            x = left + padding + (idx % grid_w) * (w + padding)
+            y = padding + (idx // grid_w) * (h + padding)
+            canvas.paste(tile, (x, y), mask=tile)
 
-    # 余白＋背景色付きキャンバスを作成
-    canvas_width = w * grid_w + padding * (grid_w + 1)
-    canvas_height = h * grid_h + padding * (grid_h + 1)
-    canvas = Image.new("RGBA", (canvas_width, canvas_height), bg_color)
+    return canvas
 
-    for idx, img in enumerate(images):
-        if idx >= grid_w * grid_h:
+# 画像名リストからグリッド画像を作成（余白と背景色を指定可能）
+def combine_images(image_names, grid_size=(5, 5), padding=10, bg_color=(255, 255, 255), tile_width=None):
+    return compose_bingo_boards([image_names], grid_size, padding, (bg_color,), tile_width=tile_width)
+
+# 画像をメモリ上のPNGにする
+def image_to_png_bytes(img):
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+# 一括作成で条件に合うカードを作り直す回数の上限
+BINGO_BATCH_ATTEMPTS = 20
+
+# デッキリストからビンゴカードをn_cards枚まとめて作る（1枚はcells個の重複しないデッキ）
+# カードごとに乱数の並べ替えを行列でまとめて作り、先頭cells個を使う
+# max_overlapを指定すると、どの2枚も共通のデッキがmax_overlap個以下になるようにする
+# （指定しなければ同じ組み合わせのカードがないようにする）
+def generate_bingo_cards(pool, n_cards, cells, seed=None, max_overlap=None):
+    if len(pool) < cells:
+        raise ValueError(f"抽出できるデッキが足りません（候補 {len(pool)} 個 / 必要 {cells} 個）")
+    if max_overlap is None:
+        max_overlap = cells - 1
+
+    rng = np.random.default_rng(seed)
+    accepted = np.empty((0, cells), dtype=np.int64)
+    incidence = np.zeros((0, len(pool)), dtype=np.int32)
+    for _ in range(BINGO_BATCH_ATTEMPTS):
+        need = n_cards - len(accepted)
+        if need == 0:
             break
-        x = padding + (idx % grid_w) * (w + padding)
-        y = padding + (idx // grid_w) * (h + padding)
-        canvas.paste(img, (x, y), mask=img)
+        batch = rng.random((need, len(pool))).argsort(axis=1)[:, :cells]
+        batch_incidence = np.zeros((need, len(pool)), dtype=np.int32)
+        np.put_along_axis(batch_incidence, batch, 1, axis=1)
+
+        # 作成済みのカードとの共通デッキ数
+        ok = (batch_incidence @ incidence.T <= max_overlap).all(axis=1)
+        # 同じバッチ内は先に採用したカードとだけ比べる
+        overlap = batch_incidence @ batch_incidence.T
+        keep = []
+        for i in np.flatnonzero(ok):
+            if all(overlap[i, j] <= max_overlap for j in keep):
+                keep.append(i)
+        accepted = np.vstack([accepted, batch[keep]])
+        incidence = np.vstack([incidence, batch_incidence[keep]])
+
+    if len(accepted) < n_cards:
+        raise ValueError(f"条件に合うカードを {n_cards} 枚作れませんでした（{len(accepted)} 枚）。共通デッキ数の上限を緩めてください。")
+
+    pool = np.asarray(pool, dtype=object)
+    return [list(pool[card]) for card in accepted]
+
+# ビンゴカードをまとめてZIP（カードごとのPNGと一覧csv）にする
+def bingo_cards_to_zip(cards, n):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        listing = pd.DataFrame(cards, columns=[f"{i + 1}" for i in range(n * n)])
+        listing.index = [f"カード{i + 1}" for i in range(len(cards))]
+        zf.writestr("cards.csv", listing.to_csv().encode("utf-8-sig"))
+        for i, card in enumerate(cards):
+            board = combine_images(card, grid_size=(n, n), padding=15)
+            if board is None:
+                continue
+            zf.writestr(f"bingo_card_{i + 1:03d}.png", image_to_png_bytes(board))
+    return buffer.getvalue()
+
+# PDFのマスの幅（縮小画像の幅）と、一度にPDFへ書き込むページ数
+# 全ページを元の大きさのままメモリに溜めると、数百枚で数GBになるため
+BINGO_PDF_TILE_WIDTH = THUMBNAIL_WIDTHS[0]
+BINGO_PDF_CHUNK_PAGES = 50
+
+# ビンゴカードをまとめて1つのPDF（1ページ1枚）にする
+# 縮小したマスで作り、一時ファイルに少しずつ追記する
+def bingo_cards_to_pdf(cards, n):
+    with tempfile.TemporaryFile() as fh:
+        written = False
+        for start in range(0, len(cards), BINGO_PDF_CHUNK_PAGES):
+            pages = []
+            for card in cards[start:start + BINGO_PDF_CHUNK_PAGES]:
+                board = combine_images(card, grid_size=(n, n), padding=15, tile_width=BINGO_PDF_TILE_WIDTH)
+                if board is not None:
+                    pages.append(board)
+            if not pages:
+                continue
+            pages[0].save(fh, format="PDF", save_all=True, append_images=pages[1:], append=written)
+            written = True
+        if not written:
+            return None
+        fh.seek(0)
+        return fh.read()
 
-    return canvas
+# ビンゴカードの一括作成
+def bingo_bulk(n):
+    st.subheader("ビンゴカード一括作成")
+    if "df_temp" not in st.session_state:
+        st.info("左側のデッキリストを選択すると、そのデッキリストからまとめて作成できます。")
+        return
 
-# 2つの画像群を１つの画像にする
-def combine_two_boards(board1, board2, space=50):
-    """
-    2つの画像を横並びに結合。
-    左背景＝白、右背景＝黒。
-    """
+    cells = n * n
+    pool = deck_pool(st.session_state.df_temp)
+    colums = st.columns(3)
+    with colums[0]:
+        n_cards = st.number_input("作成する枚数", min_value=1, max_value=500, value=30, step=1)
+    with colums[1]:
+        max_overlap = st.slider("2枚の共通デッキ数の上限", 0, cells - 1, cells - 1)
+    with colums[2]:
+        seed_text = st.text_input("シード（空欄ならランダム）", key="bingo_bulk_seed")
+
+    if st.button("まとめて作成"):
+        try:
+            seed = parse_draw_seed(seed_text)
+            cards = generate_bingo_cards(pool, int(n_cards), cells, seed, max_overlap)
+        except ValueError as e:
+            st.error(e)
+        else:
+            st.session_state.bingo_bulk = {"seed": seed, "n": n, "cards": cards, "zip": None, "pdf": None}
 
-    # 左（白）と右（黒）をRGBAで作成
-    white_bg = Image.new("RGBA", board1.size, (255, 255, 255, 255))
-    black_bg = Image.new("RGBA", board2.size, (0, 0, 0, 255))
+    bulk = st.session_state.get("bingo_bulk")
+    if bulk is None or bulk["n"] != n:
+        return
 
-    # 背景合成（透過がある場合も対応）
-    board1_on_white = Image.alpha_composite(white_bg, board1)
-    board2_on_black = Image.alpha_composite(black_bg, board2)
+    st.write(f"{len(bulk['cards'])} 枚作成しました（シード: {bulk['seed']}）")
+    st.dataframe(pd.DataFrame(bulk["cards"], index=[f"カード{i + 1}" for i in range(len(bulk["cards"]))]))
 
-    # 2枚を横に並べる
-    total_width = board1.width + board2.width + space
-    max_height = max(board1.height, board2.height)
-    combined = Image.new("RGBA", (total_width, max_height), (255, 255, 255, 255))
+    colums = st.columns(2)
+    with colums[0]:
+        if bulk["zip"] is None and st.button("ZIPを作成"):
+            bulk["zip"] = bingo_cards_to_zip(bulk["cards"], n)
+        if bulk["zip"] is not None:
+            st.download_button("ZIPをダウンロード", data=bulk["zip"], file_name="bingo_cards.zip", mime="application/zip")
+    with colums[1]:
+        if bulk["pdf"] is None and st.button("PDFを作成"):
+            bulk["pdf"] = bingo_cards_to_pdf(bulk["cards"], n)
+        if bulk["pdf"] is not None:
+            st.download_button("PDFをダウンロード", data=bulk["pdf"], file_name="bingo_cards.pdf", mime="application/pdf")
+
+# n*nのカードの縦・横・斜めの各列のビットマスク（マスiがビットi）
+def bingo_line_masks(n):
+    rows = [sum(1 << (r * n + c) for c in range(n)) for r in range(n)]
+    cols = [sum(1 << (r * n + c) for r in range(n)) for c in range(n)]
+    diagonals = [sum(1 << (i * n + i) for i in range(n)), sum(1 << (i * n + n - 1 - i) for i in range(n))]
+    return tuple(rows + cols + diagonals)
+
+BINGO_LINE_MASKS = {n: bingo_line_masks(n) for n in (3, 5)}
+
+# ビンゴの進行（カードごとに開いたマスをビットで持つ）
+# デッキ→(カード, マス)の索引で、コールしたデッキを全カードに一度に反映する
+class BingoGame:
+    def __init__(self, cards, n):
+        self.cards = [list(card) for card in cards]
+        self.n = n
+        self.line_masks = BINGO_LINE_MASKS.get(n) or bingo_line_masks(n)
+        self.marks = [0] * len(self.cards)
+        # コールした順のデッキと、コール済みか調べるための集合
+        self.called = []
+        self.called_set = set()
+        self.index = {}
+        for card_idx, card in enumerate(self.cards):
+            for cell, deck in enumerate(card):
+                self.index.setdefault(normalize_deck_name(deck), []).append((card_idx, cell))
+        # ビンゴになった順のカード
+        self.winners = []
+
+    # デッキをコールし、新しくビンゴになったカードを返す
+    def call(self, deck):
+        deck = normalize_deck_name(deck)
+        if deck in self.called_set:
+            return []
+        self.called.append(deck)
+        self.called_set.add(deck)
+        new_winners = []
+        for card_idx, cell in self.index.get(deck, []):
+            before = self.lines(card_idx)
+            self.marks[card_idx] |= 1 << cell
+            if before == 0 and self.lines(card_idx) > 0:
+                new_winners.append(card_idx)
+        self.winners.extend(new_winners)
+        return new_winners
+
+    # そろった列の数
+    def lines(self, card_idx):
+        mark = self.marks[card_idx]
+        return sum(1 for mask in self.line_masks if mark & mask == mask)
+
+    # あと1マスでそろう列の数
+    def reaches(self, card_idx):
+        mark = self.marks[card_idx]
+        return sum(1 for mask in self.line_masks if bin(mask & ~mark).count("1") == 1)
+
+    def is_marked(self, card_idx, cell):
+        return bool(self.marks[card_idx] >> cell & 1)
+
+    def decks(self):
+        return sorted(self.index)
+
+# 作成済みのビンゴカードで進行する
+def bingo_game_view(n):
+    st.subheader("ビンゴ進行")
+    cards = {}
+    if st.session_state.output_bingo_decks:
+        cards["左のカード"] = st.session_state.output_bingo_decks
+    if st.session_state.output_bingo_decks2:
+        cards["右のカード"] = st.session_state.output_bingo_decks2
+    bulk = st.session_state.get("bingo_bulk")
+    if bulk is not None and bulk["n"] == n:
+        for i, card in enumerate(bulk["cards"]):
+            cards[f"カード{i + 1}"] = card
+    cards = {name: card for name, card in cards.items() if len(card) == n * n}
+    if not cards:
+        st.info("ビンゴカードを作成すると、コールしたデッキのマークとビンゴの判定ができます。")
+        return
 
-    combined.paste(board1_on_white, (0, 0))
-    combined.paste(board2_on_black, (board1.width + space, 0))
+    # カードが変わったら新しいゲームにする
+    signature = (n, tuple(cards), tuple(tuple(card) for card in cards.values()))
+    game = st.session_state.get("bingo_game")
+    if st.button("新しいゲームを始める") or game is None or st.session_state.get("bingo_game_signature") != signature:
+        game = BingoGame(cards.values(), n)
+        st.session_state.bingo_game = game
+        st.session_state.bingo_game_signature = signature
+    names = list(cards)
+
+    remaining = [deck for deck in game.decks() if deck not in game.called_set]
+    colums = st.columns([3, 1])
+    with colums[0]:
+        called_deck = st.selectbox("コールするデッキ", remaining) if remaining else None
+    with colums[1]:
+        if called_deck is not None and st.button("コール"):
+            for card_idx in game.call(called_deck):
+                st.success(f"{names[card_idx]} がビンゴです！")
+
+    st.write(f"コール済み（{len(game.called)}）: {', '.join(game.called)}")
+    if game.winners:
+        st.write(f"ビンゴ: {', '.join(names[card_idx] for card_idx in game.winners)}")
+
+    st.dataframe(pd.DataFrame({
+        "カード": names,
+        "開いたマス": [bin(mark).count("1") for mark in game.marks],
+        "リーチ": [game.reaches(card_idx) for card_idx in range(len(names))],
+        "ビンゴ": [game.lines(card_idx) for card_idx in range(len(names))],
+    }))
+
+    selected = st.selectbox("カードを表示", names)
+    card_idx = names.index(selected)
+    for r in range(n):
+        cols = st.columns(n)
+        for c in range(n):
+            cell = r * n + c
+            with cols[c]:
+                mark = "✅ " if game.is_marked(card_idx, cell) else ""
+                st.write(f"{mark}{game.cards[card_idx][cell]}")
 
-    return combined
 # ビンゴゲーム
 def bingo():
     st.title("ユニアリビンゴ")
@@ -1798,18 +3396,15 @@ def bingo():
         if "output_bingo_decks" not in st.session_state:
             st.session_state.output_bingo_decks = []
 
+        seed_text = st.text_input("シード（空欄ならランダム）", key="bingo_seed1")
         if st.button("ビンゴカード作成",key="button1"):
-            st.session_state.output_bingo_decks = []
-            for _ in range(random_bingo_deck_num):
-                deck_list_temp = []
-                # ランダムにデッキを出力
-                while True:
-                    random_value = get_random(st.session_state.df_temp)
-                    # 重複してたらもう一度実行する
-                    if random_value not in st.session_state.output_bingo_decks:
-                        break
-
-                st.session_state.output_bingo_decks.append(random_value)
+            try:
+                record = run_draw("ビンゴ1", deck_pool(st.session_state.df_temp), random_bingo_deck_num, seed=parse_draw_seed(seed_text))
+                st.session_state.output_bingo_decks = record["result"]
+                st.caption(f"シード: {record['seed']}")
+            except ValueError as e:
+                st.session_state.output_bingo_decks = []
+                st.error(e)
 
         # 画像表示（選ばれていれば常に表示）
         if st.session_state.output_bingo_decks != []:
@@ -1819,7 +3414,10 @@ def bingo():
                 for j, image_name in enumerate(st.session_state.output_bingo_decks[i:i+n]):
                     with cols[j]:
                         output_image_name = image_name + ".png"
-                        output_image(st.session_state.df_temp, output_image_name, False)
+                        output_image(output_image_name, False)
+
+        if "df_temp" in st.session_state:
+            show_draw_log("ビンゴ1", deck_pool(st.session_state.df_temp))
 
     with colums[1]:
         st.markdown(
@@ -1862,18 +3460,15 @@ def bingo():
         if "output_bingo_decks2" not in st.session_state:
             st.session_state.output_bingo_decks2 = []
 
+        seed_text2 = st.text_input("シード（空欄ならランダム）", key="bingo_seed2")
         if st.button("ビンゴカード作成",key="button2"):
-            st.session_state.output_bingo_decks2 = []
-            for _ in range(random_bingo_deck_num):
-                deck_list_temp2 = []
-                # ランダムにデッキを出力
-                while True:
-                    random_value = get_random(st.session_state.df_temp2)
-                    # 重複してたらもう一度実行する
-                    if random_value not in st.session_state.output_bingo_decks2:
-                        break
-
-                st.session_state.output_bingo_decks2.append(random_value)
+            try:
+                record = run_draw("ビンゴ2", deck_pool(st.session_state.df_temp2), random_bingo_deck_num, seed=parse_draw_seed(seed_text2))
+                st.session_state.output_bingo_decks2 = record["result"]
+                st.caption(f"シード: {record['seed']}")
+            except ValueError as e:
+                st.session_state.output_bingo_decks2 = []
+                st.error(e)
 
         # 画像表示（選ばれていれば常に表示）
         if st.session_state.output_bingo_decks2 != []:
@@ -1883,36 +3478,40 @@ def bingo():
                 for j, image_name2 in enumerate(st.session_state.output_bingo_decks2[i:i+n]):
                     with cols[j]:
                         output_image_name2 = image_name2 + ".png"
-                        output_image(st.session_state.df_temp2, output_image_name2, False)
+                        output_image(output_image_name2, False)
+
+        if "df_temp2" in st.session_state:
+            show_draw_log("ビンゴ2", deck_pool(st.session_state.df_temp2))
 
     if st.session_state.output_bingo_decks2 != [] and st.session_state.output_bingo_decks != []:
         # ====== ③ Streamlit側の統合処理 ======
         if st.button("2つのビンゴカードを1枚にまとめて出力"):
             if st.session_state.output_bingo_decks and st.session_state.output_bingo_decks2:
-                # 画像名リスト（例: 'A1.png', ...）
-                image_list1 = [name + ".png" for name in st.session_state.output_bingo_decks]
-                image_list2 = [name + ".png" for name in st.session_state.output_bingo_decks2]
-
-                # 各5x5画像群を作成
-                board1 = combine_images(st.session_state.output_bingo_decks, grid_size=(5, 5), padding=15, bg_color=(255, 255, 255, 255))
-                board2 = combine_images(st.session_state.output_bingo_decks2, grid_size=(5, 5), padding=15, bg_color=(0, 0, 0, 255))
-
-                # 2つを横並びに合成
-                if board1 and board2:
-                    combined = combine_two_boards(board1, board2, space=80)
-                    combined.save("bingo_combined.png")
-                    # st.image(combined, caption="白と黒のビンゴカード（余白付き）", use_container_width=True)
-
-                with open("bingo_combined.png", "rb") as f:
+                # 左（白）と右（黒）のボードを1枚に合成（ファイルには書き出さない）
+                combined = compose_bingo_boards(
+                    [st.session_state.output_bingo_decks, st.session_state.output_bingo_decks2],
+                    grid_size=(n, n),
+                    padding=15,
+                    bg_colors=((255, 255, 255), (0, 0, 0)),
+                    space=80,
+                )
+                # st.image(combined, caption="白と黒のビンゴカード（余白付き）", use_container_width=True)
+
+                if combined is not None:
                     st.download_button(
                         label="画像をダウンロード",
-                        data=f,
+                        data=image_to_png_bytes(combined),
                         file_name="bingo_combined.png",
                         mime="image/png"
                     )
             else:
                 st.warning("両方のビンゴカードを作成してから出力してください。")
 
+    st.write("_____________________________________________________________")
+    bingo_bulk(n)
+
+    st.write("_____________________________________________________________")
+    bingo_game_view(n)
 
     st.write("_____________________________________________________________")
     if st.button("戻る"):
@@ -1923,16 +3522,16 @@ def bingo():
 def player_info():
     st.title("プレイヤー情報")
 
-    # st.dataframe(st.session_state.player_df)
+    # st.dataframe(st.session_state.players.to_df())
 
-    if len(st.session_state.player_df) == 1:
+    if len(st.session_state.players) == 1:
         player_num = 1
     else:
-        player_num = st.slider("表示するプレイヤー数", 1, len(st.session_state.player_df), st.session_state.player_num_default)
+        player_num = st.slider("表示するプレイヤー数", 1, len(st.session_state.players), st.session_state.player_num_default)
         st.session_state.player_num_default = player_num
 
     # プレイヤー名一覧（例：DataFrameから抽出）
-    name_options = st.session_state.player_df["名前"].tolist()
+    name_options = st.session_state.players.names()
 
     # i 番目のプレイヤー選択に対応したキーを用意
     for i in range(player_num):
@@ -1950,49 +3549,32 @@ def player_info():
             key=player_key  # ここでセッションと自動同期される
         )
 
-        # image_namesを取得（安全に抽出）
-        try:
-            image_names_raw = st.session_state.player_df[
-                st.session_state.player_df["名前"] == selected_player
-            ]["image_names"].values[0]
-        except IndexError:
+        if selected_player not in st.session_state.players:
             st.warning("プレイヤーデータが見つかりません。")
             continue
 
-        # image_names をリストに変換（文字列の場合）
-        try:
-            image_list = ast.literal_eval(image_names_raw) if isinstance(image_names_raw, str) else image_names_raw
-            if isinstance(image_list, list) and len(image_list) > 0:
-                tier_sum = 0
-                for k in range(0, len(image_list), 3):
-                    cols = st.columns(3)  # 3つの列を作成
-                    for j, image_name in enumerate(image_list[k:k+3]):
-                        with cols[j]:
-                            # Tierを合計する
-                            deck_name = image_name.replace(".png", "")
-                            tier_sum += Tier_of_Deck(deck_name)
-                            # 画像を出力
-                            output_image(st.session_state.create_df_temp2, image_name)
-                            if st.button("このデッキを削除",key=f"player_{i}_deck_{k + j}"):
-                                remove_image_name(selected_player, image_name)
-                # my_deck_listのtierの平均を計算
-                tier_avg = tier_sum / len(image_list)
-                truncated_tier_avg = math.floor(tier_avg  * 100) / 100      # 小数点2位以下切り捨て
-                st.header(f"Tierの合計：{tier_sum},　　Tierの平均：{truncated_tier_avg}")
-                if st.button(f"{selected_player}のデッキリストをリセット",key=f"player_{i}_deck_list"):
-                        # プレイヤーの該当行のインデックスを取得
-                    idx = st.session_state.player_df[st.session_state.player_df["名前"] == selected_player].index
-
-                    if not idx.empty:
-                        st.session_state.player_df.at[idx[0], "image_names"] = None
-                        st.session_state.player_df.at[idx[0], "deck_order"] = None
-                        st.success(f"{selected_player}のデッキリストをリセットしました")
-                        st.session_state.player_df.to_csv("player/new_player_list.csv", index=False)
-                        st.rerun()
-            else:
-                st.write("デッキが登録されていません")
-        except Exception as e:
-            st.error(f"画像リストの解析に失敗しました: {e}")
+        image_list = st.session_state.players.decks(selected_player)
+        if len(image_list) > 0:
+            # Tierを合計する
+            tier_sum = float(tiers_of_decks(image_list).sum())
+            for k in range(0, len(image_list), 3):
+                cols = st.columns(3)  # 3つの列を作成
+                for j, image_name in enumerate(image_list[k:k+3]):
+                    with cols[j]:
+                        # 画像を出力
+                        output_image(image_name)
+                        if st.button("このデッキを削除",key=f"player_{i}_deck_{k + j}"):
+                            remove_image_name(selected_player, image_name)
+            # my_deck_listのtierの平均を計算
+            tier_avg = tier_sum / len(image_list)
+            truncated_tier_avg = math.floor(tier_avg  * 100) / 100      # 小数点2位以下切り捨て
+            st.header(f"Tierの合計：{tier_sum},　　Tierの平均：{truncated_tier_avg}")
+            if st.button(f"{selected_player}のデッキリストをリセット",key=f"player_{i}_deck_list"):
+                st.session_state.players.reset(selected_player)
+                st.success(f"{selected_player}のデッキリストをリセットしました")
+                st.rerun()
+        else:
+            st.write("デッキが登録されていません")
         # 取得したimage_namesの画像をoutput_imageによって画像で出力
 
         st.write("_____________________________________________________________")
@@ -2002,9 +3584,9 @@ def player_set():
 
     # PLAYERを管理するCSVファイルを取得
     # CSV読み込み（セッション内に保持）
-    if "player_df" not in st.session_state:
+    if "players" not in st.session_state:
         try:
-            st.session_state.player_df = pd.read_csv("player/player.csv")
+            st.session_state.players = PlayerStore.from_df(pd.read_csv("player/player.csv"))
         except FileNotFoundError:
             st.error("PLAYER.csv が見つかりません。ファイルを正しい場所に置いてください。")
             st.stop()
@@ -2012,7 +3594,7 @@ def player_set():
     st.subheader("プレイヤー一覧")
     
     # データフレームの表示
-    st.dataframe(st.session_state.player_df['名前'])
+    st.dataframe(pd.DataFrame({"名前": st.session_state.players.names()}))
 
     st.write("_____________________________________________________________")
     if st.button("プレイヤー追加"):
@@ -2031,7 +3613,7 @@ def player_add():
     st.title("プレイヤー追加")
     
     st.subheader("プレイヤー一覧")
-    st.dataframe(st.session_state.player_df['名前'])
+    st.dataframe(pd.DataFrame({"名前": st.session_state.players.names()}))
 
     # 入力フォーム
     new_name = st.text_input("名前を入力してください")
@@ -2041,50 +3623,34 @@ def player_add():
         if st.button("名前を追加"):
             if new_name.strip() == "":
                 st.warning("空白の名前は追加できません。")
-            elif new_name in st.session_state.player_df["名前"].values:
+            elif not st.session_state.players.add_player(new_name):
                 st.warning(f"'{new_name}' はすでにリストに存在します。")
             else:
-                # 名前を1行のDataFrameにして追加
-                new_row = pd.DataFrame([[new_name]], columns=["名前"])
-                player_df = pd.concat([st.session_state.player_df, new_row], ignore_index=True)
-                # CSVファイルとして保存
-                player_df.to_csv("player/new_player_list.csv", index=False)
-
                 st.success(f"{new_name} を追加しました！")
 
     with col2:
         if st.button("名前を削除"):
             if new_name.strip() == "":
                 st.warning("空白の名前は削除できません。")
-            elif new_name not in st.session_state.player_df["名前"].values:
+            elif not st.session_state.players.remove_player(new_name):
                 st.warning(f"'{new_name}' はリストに存在しません。")
             else:
-                # 名前を1行のDataFrameにして追加
-                player_df = st.session_state.player_df[st.session_state.player_df['名前'] != new_name]
-                # CSVファイルとして保存
-                player_df.to_csv("player/new_player_list.csv", index=False)
-
                 st.success(f"{new_name} を削除しました！")
 
     # 保存ボタンでセッションとCSVに反映
     if st.button("プレイヤー一覧を保存"):
-        try:
-            # 一時ファイルがあれば読み込んで session_state に反映
-            temp_df = pd.read_csv("player/new_player_list.csv")
-            st.session_state.player_df = temp_df
-            # save_csv()
-            save_csv_to_cloud(st.session_state.player_df)
+        # save_csv()
+        st.session_state.players.flush()
+        uploaded, conflicts = sync_players_to_cloud(st.session_state.players)
+        show_player_conflicts(conflicts)
+        if uploaded:
             st.success("プレイヤー一覧を保存しました！")
-        except FileNotFoundError:
-            st.error("保存前に名前を追加してください。")
+        else:
+            st.info("前回の保存から変更はありません。")
 
     # 表示
     st.subheader("現在のプレイヤー一覧（未保存の追加も含む）")
-    if os.path.exists("player/new_player_list.csv"):
-        preview_df = pd.read_csv("player/new_player_list.csv")
-        st.dataframe(preview_df['名前'])
-    else:
-        st.dataframe(st.session_state.player_df['名前'])  
+    st.dataframe(pd.DataFrame({"名前": st.session_state.players.names()}))
 
     st.write("_____________________________________________________________")
     if st.button("戻る"):
@@ -2109,7 +3675,7 @@ def player_UD():
     file_name_input = "PLAYER_DF_" + date_str
 
     if file_name_input != "":
-        download_dataframe_as_csv(file_name_input, st.session_state.player_df)
+        download_dataframe_as_csv(file_name_input, st.session_state.players.to_df())
 
     st.write("_____________________________________________________________")
     st.subheader("プレイヤーDFをアップロード")
@@ -2117,11 +3683,21 @@ def player_UD():
     if player_df_csv:
         try:
             player_df_temp = pd.read_csv(player_df_csv)
-            st.session_state.player_df = player_df_temp
-            st.session_state.player_df.to_csv("player/new_player_list.csv", index=False)
-            st.success("プレイヤーファイルを読み込みました!")
+            uploaded_players = PlayerStore.from_df(player_df_temp)
         except Exception as e:
             st.error(f"ファイル1の読み込みエラー: {e}")
+        else:
+            # 全セッションで共有する一覧なので、差分を確認してから反映する
+            changed, removed = st.session_state.players.diff(uploaded_players)
+            if not changed and not removed:
+                st.info("現在のプレイヤー一覧と同じ内容です。")
+            else:
+                st.warning(f"全ての端末のプレイヤー一覧に反映されます（変更・追加: {len(changed)}人、削除: {len(removed)}人）")
+                if removed:
+                    st.write(f"削除されるプレイヤー: {', '.join(removed)}")
+                if st.button("アップロードした内容を反映"):
+                    st.session_state.players.import_players(uploaded_players)
+                    st.success("プレイヤーファイルを読み込みました!")
     else:
         st.info("CSVファイルをアップロードしてください。")
 
@@ -2159,7 +3735,7 @@ def Tier_list_check_ALL():
 
     # DataFrameが st.session_state に存在するか確認
     if "Tier_df_temp" in st.session_state and not st.session_state.Tier_df_temp.empty:
-        tier_list = ["Tier1.0", "Tier1.5", "Tier2.0", "Tier2.5", "Tier3.0", "Tier4.0", "Tier5.0"]
+        tier_list = TIER_COLUMNS
 
 
         for selected_column in tier_list:
@@ -2178,11 +3754,14 @@ def Tier_list_check_ALL():
                 cols = st.columns(n)
                 for j, image_name in enumerate(image_names[i:i+n]):
                     with cols[j]:
-                        output_image(df, image_name, False)
+                        output_image(image_name, False)
 
     else:
         st.warning("データフレームが存在しないか空です。")
 
+    st.write("_____________________________________________________________")
+    tier_recalibration_view()
+
 # 簡易版スタート
 def quick_start():
     st.subheader("デッキリスト選択")
@@ -2201,24 +3780,17 @@ def quick_start():
         check_box = st.checkbox("アップロードファイルを表示")
         if check_box:
             st.dataframe(st.session_state.df)
-            tier_values = []
+            tier_values = tiers_of_decks(deck_names_of_df(st.session_state.df)).dropna()
 
-            for col in st.session_state.df.columns:
-                for val in st.session_state.df[col]:
-                    if pd.notna(val):
-                        tier_num = Tier_of_Deck(val)
-                        if tier_num is not None:
-                            tier_values.append(tier_num)
-
-            if tier_values:
-                average_tier = sum(tier_values) / len(tier_values)
+            if not tier_values.empty:
+                average_tier = tier_values.mean()
                 st.write(f"総デッキ数: {len(tier_values)}")
                 st.write(f"平均Tier: {average_tier:.2f}")
 
     st.write("_____________________________________________________________")
     # PLAYER選択
     st.subheader("PLAYER選択")
-    player_list = list(st.session_state.player_df["名前"])
+    player_list = st.session_state.players.names()
     player_list.append("（なし）")
 
     # プレイヤーを選択
@@ -2234,68 +3806,33 @@ def quick_start():
         st.subheader("ランダム抽出")
         # 均一ルールをオンにチェックボックス
         st.session_state.uniform_role_flag = st.checkbox("均一ルール")
+        target = None
+        if st.session_state.uniform_role_flag:
+            st.session_state.select_output_style = st.radio("均一の基準にする数値", UNIFORM_TARGETS, horizontal=True)
+            target = uniform_target(st.session_state.select_output_style)
         # ランダムで出力するデッキ数を選択
         random_deck_num = st.slider("出力するデッキ数", 1, 10, st.session_state.output_deck_num_default)
         # スライダーのデフォルトを設定
         st.session_state.output_deck_num_default = random_deck_num
 
-        avg_tier = Avg_Tier_of_Deck(selected_player)
-
-        # ランダム関数を使ってDFから１つ選択する。内容がNoneなら再度実施する
+        # デッキリストからまとめて抽出する（候補が足りなければエラーを表示）
         # ボタンを押したらランダム抽出
+        seed_text = st.text_input("シード（空欄ならランダム）", key="draw_seed")
         if st.button("ランダム抽出"):
-            st.session_state.output_decks = []
-
-            for _ in range(random_deck_num):
-
-                if st.session_state.output_decks != []:
-                    player_decks = st.session_state.player_df[st.session_state.player_df["名前"] == selected_player]["image_names"].values[0]
-                    if not pd.isna(player_decks):
-                        # player_decksをstrからリスト形式に
-                        player_decks = re.findall(r"\['(.*?)'\]", player_decks)
-                        player_decks_temp = []
-                        for deck in player_decks:
-                            deck_name = deck.replace(".png", "")
-                            player_decks_temp.append(deck_name)
-                        # シングルクォートとカンマで分割
-                        if player_decks_temp and isinstance(player_decks_temp[0], str):
-                            player_decks_temp = [deck.strip(" '") for deck in player_decks_temp[0].split(",")]
-                        else:
-                            player_decks_temp = []
-                        deck_list_temp = st.session_state.output_decks + player_decks_temp
-                    else:
-                        deck_list_temp = st.session_state.output_decks
-                        
-                    sum_tier_temp = 0
-                    for i in range(0, len(deck_list_temp)):
-                        sum_tier_temp += Tier_of_Deck(deck_list_temp[i])
-
-                    avg_tier_temp = sum_tier_temp / len(deck_list_temp)
-                else:
-                    deck_list_temp = []
-                    avg_tier_temp = avg_tier
-
-                if st.session_state.uniform_role_flag and avg_tier_temp is not None:
-                    p = st.session_state.avg_tier
-                    while True:
-                        random_value = get_random(st.session_state.df)
-                        # 重複してたらもう一度実行する
-                        if random_value not in deck_list_temp:
-                            deck_tier = Tier_of_Deck(random_value)
-                            if avg_tier_temp < p:
-                                if deck_tier > p:
-                                    break
-                            else:
-                                if deck_tier < p:
-                                    break
-                else:
-                    while True:
-                        random_value = get_random(st.session_state.df)
-                        # 重複してたらもう一度実行する
-                        if random_value not in deck_list_temp:
-                            break
-
-                st.session_state.output_decks.append(random_value)
+            try:
+                record = run_draw(
+                    "クイックスタート",
+                    deck_pool(st.session_state.df),
+                    random_deck_num,
+                    st.session_state.players.decks(selected_player),
+                    target,
+                    parse_draw_seed(seed_text),
+                )
+                st.session_state.output_decks = record["result"]
+                st.caption(f"シード: {record['seed']}")
+            except ValueError as e:
+                st.session_state.output_decks = []
+                st.error(e)
 
         # 画像表示（選ばれていれば常に表示）
         if st.session_state.output_decks != []:
@@ -2305,38 +3842,30 @@ def quick_start():
                 for j, image_name in enumerate(st.session_state.output_decks[i:i+3]):
                     with cols[j]:
                         output_image_name = image_name + ".png"
-                        output_image(st.session_state.df, output_image_name)
+                        output_image(output_image_name)
 
             if st.button(f'{selected_player}にこのデッキを登録する'):
                 for i in range(0, len(st.session_state.output_decks)):
                     output_image_name = st.session_state.output_decks[i] + ".png"
                     save_image_names(selected_player, output_image_name)
 
+        show_draw_log("クイックスタート", deck_pool(st.session_state.df))
+
         # st.write("_____________________________________________________________")
         # デッキ確認
         # st.subheader(f"{selected_player}のデッキリスト")
-        # image_namesを取得（安全に抽出）
-        try:
-            image_names_raw = st.session_state.player_df[
-                st.session_state.player_df["名前"] == selected_player
-            ]["image_names"].values[0]
-        except IndexError:
-            st.warning("プレイヤーデータが見つかりません。")
-
-        image_list = ast.literal_eval(image_names_raw) if isinstance(image_names_raw, str) else image_names_raw
-        if isinstance(image_list, list) and len(image_list) > 0:
+        image_list = st.session_state.players.decks(selected_player)
+        if len(image_list) > 0:
             st.write("_____________________________________________________________")
             st.subheader(f"{selected_player}のデッキリスト")
-            tier_sum = 0
+            # Tierを合計する
+            tier_sum = float(tiers_of_decks(image_list).sum())
             for k in range(0, len(image_list), 3):
                 cols = st.columns(3)  # 3つの列を作成
                 for j, image_name in enumerate(image_list[k:k+3]):
                     with cols[j]:
-                        # Tierを合計する
-                        deck_name = image_name.replace(".png", "")
-                        tier_sum += Tier_of_Deck(deck_name)
                         # 画像を出力
-                        output_image(st.session_state.create_df_temp2, image_name)
+                        output_image(image_name)
             # my_deck_listのtierの平均を計算
             tier_avg = tier_sum / len(image_list)
             truncated_tier_avg = math.floor(tier_avg  * 100) / 100      # 小数点2位以下切り捨て
@@ -2393,9 +3922,10 @@ def debag():
 
 def main():
 
-    init()
+    # 画像ファイル名の正規化はカタログ作成より先に行う
+    ensure_image_filenames_normalized()
 
-    normalize_image_filenames()
+    init()
 
     # page_id_list = ["データベース選択","ランダム抽出","デッキリスト_カスタマイズ","デュエル","プレイヤー情報","プレイヤー設定","Tier表","クイックスタート","デバッグページ"]
     page_id_list = ["データベース選択","ランダム抽出","デッキリスト_カスタマイズ","デュエル","プレイヤー情報","プレイヤー設定","Tier表","クイックスタート"]
@@ -2410,91 +3940,95 @@ def main():
 
         # 保存ボタンでセッションとCSVに反映
         if st.sidebar.button("プレイヤーDFを保存",key=f"save_button_1"):
-            try:
-                # 一時ファイルがあれば読み込んで session_state に反映
-                temp_df = pd.read_csv("player/new_player_list.csv")
-                st.session_state.player_df = temp_df
-                # save_csv()
-                save_csv_to_cloud(st.session_state.player_df)
+            # save_csv()
+            st.session_state.players.flush()
+            uploaded, conflicts = sync_players_to_cloud(st.session_state.players)
+            show_player_conflicts(conflicts, st.sidebar)
+            if uploaded:
                 st.sidebar.success("プレイヤー一覧を保存しました！")
-            except FileNotFoundError:
-                st.sidebar.error("保存前に名前を追加してください。")
+            else:
+                st.sidebar.info("前回の保存から変更はありません。")
 
         # ボタンを押すとPLAYER_DFの状態を更新
         if st.sidebar.button("プレイヤー一覧を読み込み",key=f"load_button_1"):
-            # st.session_state.player_df = pd.read_csv("player/player.csv")
-            st.session_state.player_df = load_csv_from_cloud()
+            # st.session_state.players = PlayerStore.from_df(pd.read_csv("player/player.csv"))
+            conflicts = reload_players_from_cloud(st.session_state.players)
+            show_player_conflicts(conflicts, st.sidebar)
 
         chec_box = st.sidebar.checkbox("画面更新用",key="update")
         if chec_box:
             st.sidebar.success("画面が更新されました")
 
-    if st.session_state.page_id == "ホーム画面":
-        home_screen()
+    # st.rerun() で中断された場合も、このリクエストの変更をまとめて保存する
+    try:
+        if st.session_state.page_id == "ホーム画面":
+            home_screen()
 
-    if st.session_state.page_id == "データベース選択":
-        csv_app()
+        if st.session_state.page_id == "データベース選択":
+            csv_app()
 
-    if st.session_state.page_id == "データベース作成":
-        create_csv()
+        if st.session_state.page_id == "データベース作成":
+            create_csv()
     
-    # 2つのアップロードファイルを結合して作成
-    if st.session_state.page_id == "データベース作成_1":
-        create_csv_1()
+        # 2つのアップロードファイルを結合して作成
+        if st.session_state.page_id == "データベース作成_1":
+            create_csv_1()
 
-    # 1つのアップロードファイルにデッキを追加して作成
-    if st.session_state.page_id == "データベース作成_2":
-        create_csv_2()
+        # 1つのアップロードファイルにデッキを追加して作成
+        if st.session_state.page_id == "データベース作成_2":
+            create_csv_2()
 
-    # 色からファイルを作成
-    if st.session_state.page_id == "データベース作成_3_1":
-        create_csv_3_1()
+        # 色からファイルを作成
+        if st.session_state.page_id == "データベース作成_3_1":
+            create_csv_3_1()
 
-    if st.session_state.page_id == "ランダム抽出":
-        random_app()
+        if st.session_state.page_id == "ランダム抽出":
+            random_app()
 
-    if st.session_state.page_id == "デッキリスト_カスタマイズ":
-        customize()
+        if st.session_state.page_id == "デッキリスト_カスタマイズ":
+            customize()
 
-    if st.session_state.page_id == "デュエル":
-        duel()
+        if st.session_state.page_id == "デュエル":
+            duel()
 
-    if st.session_state.page_id == "デュエルスタンバイ":
-        duel_standby()
+        if st.session_state.page_id == "デュエルスタンバイ":
+            duel_standby()
 
-    if st.session_state.page_id == "デュエルスタート":
-        duel_start()
+        if st.session_state.page_id == "デュエルスタート":
+            duel_start()
 
-    if st.session_state.page_id == "対戦成績照会":
-        duel_grades()
+        if st.session_state.page_id == "対戦成績照会":
+            duel_grades()
 
-    if st.session_state.page_id == "成績ファイル結合":
-        combine_grades()
+        if st.session_state.page_id == "成績ファイル結合":
+            combine_grades()
 
-    if st.session_state.page_id == "ユニアリビンゴ":
-        bingo()
+        if st.session_state.page_id == "ユニアリビンゴ":
+            bingo()
 
-    if st.session_state.page_id == "プレイヤー情報":
-        player_info()
+        if st.session_state.page_id == "プレイヤー情報":
+            player_info()
 
-    if st.session_state.page_id == "プレイヤー設定":
-        player_set()
+        if st.session_state.page_id == "プレイヤー設定":
+            player_set()
 
-    if st.session_state.page_id == "プレイヤー追加":
-        player_add()
+        if st.session_state.page_id == "プレイヤー追加":
+            player_add()
 
-    if st.session_state.page_id == "プレイヤーU&D":
-        player_UD()
+        if st.session_state.page_id == "プレイヤーU&D":
+            player_UD()
 
-    if st.session_state.page_id == "Tier表":
-        Tier_list_check_ALL()
+        if st.session_state.page_id == "Tier表":
+            Tier_list_check_ALL()
 
-    if st.session_state.page_id == "クイックスタート":
-        quick_start()
+        if st.session_state.page_id == "クイックスタート":
+            quick_start()
 
 
-    if st.session_state.page_id == "デバッグページ":
-        debag()
+        if st.session_state.page_id == "デバッグページ":
+            debag()
+    finally:
+        flush_players()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,114 @@
+import itertools
+
+import pytest
+
+from analysis_db import BingoGame, generate_bingo_cards
+
+
+def grid(n, prefix="d"):
+    return [f"{prefix}{i}" for i in range(n * n)]
+
+
+def call_all(game, decks):
+    winners = []
+    for deck in decks:
+        winners.extend(game.call(deck))
+    return winners
+
+
+@pytest.mark.parametrize("n", [3, 4, 5])
+def test_every_row_column_and_diagonal_is_a_bingo(n):
+    card = grid(n)
+    lines = [[r * n + c for c in range(n)] for r in range(n)]
+    lines += [[r * n + c for r in range(n)] for c in range(n)]
+    lines += [[i * n + i for i in range(n)], [i * n + n - 1 - i for i in range(n)]]
+    for line in lines:
+        game = BingoGame([card], n)
+        assert call_all(game, [card[cell] for cell in line[:-1]]) == []
+        assert game.reaches(0) >= 1
+        assert game.call(card[line[-1]]) == [0]
+        assert game.lines(0) == 1
+        assert game.winners == [0]
+
+
+def test_scattered_cells_are_not_a_bingo():
+    card = grid(3)
+    game = BingoGame([card], 3)
+    assert call_all(game, [card[0], card[5], card[7]]) == []
+    assert game.lines(0) == 0
+    assert [game.is_marked(0, cell) for cell in range(9)] == [c in (0, 5, 7) for c in range(9)]
+
+
+def test_one_call_marks_every_card_and_winners_keep_order():
+    left = grid(3)
+    right = list(reversed(left))
+    game = BingoGame([left, right], 3)
+    assert call_all(game, left[:2]) == []
+    # 左は上の行、右は下の行が同じコールでそろう
+    assert game.call(left[2]) == [0, 1]
+    assert game.lines(1) == 1
+    assert [game.is_marked(1, cell) for cell in (6, 7, 8)] == [True, True, True]
+    assert call_all(game, left[3:6]) == []
+    assert game.winners == [0, 1]
+
+
+def test_repeated_calls_are_ignored():
+    card = grid(3)
+    game = BingoGame([card], 3)
+    game.call(card[0])
+    game.call(card[0])
+    assert game.called == [card[0]]
+    assert call_all(game, card[1:3]) == [0]
+    # 既にビンゴのカードは再び勝者にならない
+    assert call_all(game, card[3:6]) == []
+    assert game.lines(0) == 2
+    assert game.winners == [0]
+
+
+def test_deck_names_are_normalized():
+    card = [f"デッキ{i}.png" for i in range(9)]
+    game = BingoGame([card], 3)
+    assert call_all(game, [f"デッキ{i}" for i in (2, 4, 6)]) == [0]
+    assert "デッキ0" in game.decks()
+
+
+def test_reaches_count_lines_one_cell_short():
+    card = grid(3)
+    game = BingoGame([card], 3)
+    assert game.reaches(0) == 0
+    call_all(game, [card[0], card[4]])
+    # 上の行・左の列は2マス残り、斜めだけがリーチ
+    assert game.reaches(0) == 1
+    game.call(card[1])
+    # 斜め・上の行・真ん中の列
+    assert game.reaches(0) == 3
+
+
+@pytest.mark.parametrize("max_overlap", [None, 5, 2])
+def test_generated_cards_respect_the_overlap_bound(max_overlap):
+    pool = [f"deck{i}" for i in range(100)]
+    cards = generate_bingo_cards(pool, 30, 9, seed=1, max_overlap=max_overlap)
+    assert len(cards) == 30
+    bound = 8 if max_overlap is None else max_overlap
+    for card in cards:
+        assert len(set(card)) == 9
+        assert set(card) <= set(pool)
+    for a, b in itertools.combinations(cards, 2):
+        assert len(set(a) & set(b)) <= bound
+
+
+def test_same_seed_gives_same_cards():
+    pool = [f"deck{i}" for i in range(40)]
+    assert generate_bingo_cards(pool, 10, 25, seed=42) == generate_bingo_cards(pool, 10, 25, seed=42)
+    assert generate_bingo_cards(pool, 10, 25, seed=42) != generate_bingo_cards(pool, 10, 25, seed=43)
+
+
+def test_too_small_pool_is_an_error():
+    with pytest.raises(ValueError):
+        generate_bingo_cards([f"deck{i}" for i in range(8)], 1, 9, seed=0)
+
+
+def test_unreachable_overlap_bound_is_an_error():
+    # 9個のデッキからは共通デッキ0個のカードを2枚作れない
+    with pytest.raises(ValueError):
+        generate_bingo_cards([f"deck{i}" for i in range(9)], 2, 9, seed=0, max_overlap=0)
@@ -0,0 +1,82 @@
+import io
+
+import pandas as pd
+
+import analysis_db
+
+
+class UploadedFile(io.BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def grade_csv(rows, columns=("player1", "deck1", "player2", "deck2", "winner")):
+    return pd.DataFrame(rows, columns=list(columns)).to_csv(index=False).encode("utf-8-sig")
+
+
+def read_merged(data):
+    return pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False, encoding="utf-8-sig")
+
+
+def test_match_keys_ignore_rows_without_date_or_round():
+    chunk = pd.DataFrame({
+        "date": ["2026-10-01", "", "2026-10-01"],
+        "round": ["1", "1", ""],
+        "player1": ["A", "A", "A"],
+        "deck1": ["x.png", "x", "x"],
+        "player2": ["B", "B", "B"],
+        "deck2": ["y", "y", "y"],
+        "winner": ["A", "A", "A"],
+    })
+    keys = analysis_db.match_keys(chunk)
+    assert keys[0] is not None
+    assert keys[1] is None
+    assert keys[2] is None
+
+
+def test_match_keys_normalize_deck_names():
+    rows = {"date": ["2026-10-01"] * 2, "round": ["1"] * 2, "player1": ["A"] * 2,
+            "deck1": ["x.png", "x"], "player2": ["B"] * 2, "deck2": ["y", "y"], "winner": ["A", "B"]}
+    keys = analysis_db.match_keys(pd.DataFrame(rows))
+    assert keys[0] == keys[1]
+
+
+def test_legacy_files_from_different_days_are_all_kept():
+    day1 = grade_csv([["A", "x", "B", "y", "A"]])
+    day2 = grade_csv([["A", "x", "B", "y", "B"], ["A", "x", "B", "y", "A"]])
+    data, stats, _ = analysis_db.merge_grade_files([UploadedFile(day1, "day1"), UploadedFile(day2, "day2")])
+    assert stats["duplicates"] == 0
+    assert len(read_merged(data)) == 3
+
+
+def test_same_file_twice_is_skipped():
+    day1 = grade_csv([["A", "x", "B", "y", "A"], ["A", "x", "B", "y", "A"]])
+    data, stats, _ = analysis_db.merge_grade_files([UploadedFile(day1, "a"), UploadedFile(day1, "b")])
+    assert stats["files"] == 1
+    assert stats["skipped_files"] == 1
+    assert len(read_merged(data)) == 2
+
+
+def test_keyed_rows_are_deduplicated_across_files():
+    columns = ("date", "round", "player1", "deck1", "player2", "deck2", "winner")
+    first = grade_csv([["2026-10-01", "1", "A", "x", "B", "y", "A"]], columns)
+    second = grade_csv([
+        ["2026-10-01", "1", "A", "x.png", "B", "y", "A"],
+        ["2026-10-01", "2", "A", "z", "B", "y", "B"],
+    ], columns)
+    data, stats, preview = analysis_db.merge_grade_files([UploadedFile(first, "a"), UploadedFile(second, "b")], chunksize=1)
+    merged = read_merged(data)
+    assert stats["duplicates"] == 1
+    assert merged["round"].tolist() == ["1", "2"]
+    assert len(preview) == 2
+
+
+def test_failed_file_contributes_nothing():
+    good_rows = b"".join(b"A,x,B,y,A\n" for _ in range(5))
+    broken = b"player1,deck1,player2,deck2,winner\n" + good_rows + b'A,"x\n'
+    data, stats, preview = analysis_db.merge_grade_files([UploadedFile(broken, "broken")], chunksize=2)
+    assert stats["files"] == 0
+    assert stats["rows"] == 0
+    assert read_merged(data).empty
+    assert preview.empty
@@ -0,0 +1,72 @@
+import random
+
+import pandas as pd
+import pytest
+import streamlit as st
+
+import analysis_db
+
+
+@pytest.fixture
+def draw_session():
+    st.session_state.draw_rng = random.Random(0)
+    st.session_state.draw_log = []
+    yield
+    del st.session_state.draw_rng
+    del st.session_state.draw_log
+
+
+@pytest.fixture
+def tier_table(monkeypatch):
+    table = pd.DataFrame({"Tier": [1.0, 2.0, 3.0, 4.0, 5.0, 5.0]}, index=list("abcdef"))
+    monkeypatch.setattr(analysis_db, "get_tier_table", lambda: table)
+    return table
+
+
+def test_same_seed_gives_same_draw(draw_session, tmp_path):
+    pool = [f"deck{i}" for i in range(50)]
+    log_path = str(tmp_path / "draw_log.jsonl")
+    first = analysis_db.run_draw("test", pool, 10, seed=1234, log_path=log_path)
+    second = analysis_db.run_draw("test", pool, 10, seed=1234, log_path=log_path)
+    assert first["result"] == second["result"]
+    assert first["pool_hash"] == second["pool_hash"]
+    assert len(set(first["result"])) == 10
+
+
+def test_regenerate_from_log_file_in_a_new_session(draw_session, tier_table, tmp_path):
+    pool = list("bcdef")
+    log_path = str(tmp_path / "draw_log.jsonl")
+    record = analysis_db.run_draw("test", pool, 3, player_decks=["a.png"], target=3.0, log_path=log_path)
+
+    st.session_state.draw_log = []
+    records = analysis_db.load_draw_log("test", log_path)
+    assert [r["id"] for r in records] == [record["id"]]
+    assert analysis_db.regenerate_draw(records[0], pool) == record["result"]
+
+
+def test_regenerate_refuses_when_owned_deck_tier_changed(draw_session, tier_table, tmp_path):
+    pool = list("bcdef")
+    record = analysis_db.run_draw("test", pool, 2, player_decks=["a"], target=3.0, log_path=str(tmp_path / "log.jsonl"))
+    tier_table.loc["a", "Tier"] = 2.0
+    with pytest.raises(ValueError):
+        analysis_db.regenerate_draw(record, pool)
+
+
+def test_regenerate_refuses_when_pool_changed(draw_session, tmp_path):
+    pool = [f"deck{i}" for i in range(20)]
+    record = analysis_db.run_draw("test", pool, 5, seed=7, log_path=str(tmp_path / "log.jsonl"))
+    with pytest.raises(ValueError):
+        analysis_db.regenerate_draw(record, pool[:-1])
+
+
+def test_sample_decks_reports_exhausted_pool():
+    with pytest.raises(ValueError):
+        analysis_db.sample_decks(["a", "b"], 2, exclude=["a"])
+
+
+def test_owned_decks_are_excluded_after_normalization():
+    df = pd.DataFrame({"赤": ["ﾃｽﾄ(A)", "テスト(B)"], "青": ["テスト(C).png", None]})
+    pool = analysis_db.deck_pool(df)
+    assert pool == ["テスト(A)", "テスト(B)", "テスト(C)"]
+    drawn = analysis_db.draw_player_decks(pool, 2, ["テスト(A).png"], rng=random.Random(0))
+    assert "テスト(A)" not in drawn
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import analysis_db
+
+
+def random_matches(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    players = [f"p{i}" for i in range(8)]
+    decks = [f"d{i}" for i in range(30)]
+    player1 = rng.choice(players, n)
+    player2 = rng.choice(players, n)
+    winner = np.where(rng.random(n) < 0.5, player1, player2)
+    # 勝者がどちらでもない対戦も混ぜる
+    winner[::97] = "nobody"
+    return pd.DataFrame({
+        "id": np.arange(1, n + 1),
+        "player1": player1,
+        "deck1": rng.choice(decks, n),
+        "player2": player2,
+        "deck2": [deck + ".png" for deck in rng.choice(decks, n)],
+        "winner": winner,
+    })
+
+
+def test_rebuild_matches_incremental_updates():
+    matches = random_matches()
+    rebuilt = analysis_db.EloRatings.rebuild(matches)
+
+    incremental = analysis_db.EloRatings()
+    for start in range(0, len(matches), 300):
+        incremental.apply(matches.iloc[start:start + 300])
+
+    assert rebuilt.last_id == incremental.last_id == len(matches)
+    for kind in ("player", "deck"):
+        assert rebuilt.ratings[kind].keys() == incremental.ratings[kind].keys()
+        assert rebuilt.games[kind] == incremental.games[kind]
+        for name, rating in rebuilt.ratings[kind].items():
+            assert rating == pytest.approx(incremental.ratings[kind][name])
+
+
+def test_update_is_zero_sum_and_favours_the_winner():
+    elo = analysis_db.EloRatings()
+    elo.update("A", "x", "B", "y", "A")
+    assert elo.ratings["player"]["A"] > analysis_db.ELO_INITIAL > elo.ratings["player"]["B"]
+    assert elo.ratings["deck"]["x"] + elo.ratings["deck"]["y"] == pytest.approx(2 * analysis_db.ELO_INITIAL)
+
+
+def test_undecided_and_self_matches_are_ignored():
+    elo = analysis_db.EloRatings()
+    elo.update("A", "x", "B", "y", "C")
+    elo.update("A", "x", "A", "x", "A")
+    assert elo.ratings["player"] == {}
+    assert elo.ratings["deck"] == {}
+
+
+def test_ranking_is_sorted_by_rating():
+    elo = analysis_db.EloRatings.rebuild(random_matches(500))
+    ranking = elo.ranking("player")
+    assert ranking["順位"].tolist() == list(range(1, len(ranking) + 1))
+    assert ranking["レーティング"].is_monotonic_decreasing
@@ -0,0 +1,163 @@
+import pandas as pd
+import pytest
+
+import analysis_db
+from analysis_db import PlayerStore
+
+
+# Google Driveの代わり（player.csvを1つだけ持つ）
+class FakeDrive:
+    def __init__(self, tmp_path, df):
+        self.tmp_path = tmp_path
+        self.revision = 0
+        self.fail = False
+        self.uploads = 0
+        self.write(df.to_csv(index=False).encode("utf-8"))
+
+    def write(self, csv_data):
+        self.revision += 1
+        self.version = f"v{self.revision}"
+        (self.tmp_path / f"{self.version}.csv").write_bytes(csv_data)
+        return self.version
+
+    def fetch(self, drive_service, file_id):
+        return str(self.tmp_path / f"{self.version}.csv"), self.version
+
+    def save(self, csv_data):
+        if self.fail:
+            raise OSError("upload failed")
+        self.uploads += 1
+        return self.write(csv_data)
+
+    def players(self):
+        df = pd.read_csv(self.tmp_path / f"{self.version}.csv")
+        return PlayerStore.from_df(df)
+
+
+@pytest.fixture
+def drive(tmp_path, monkeypatch):
+    df = pd.DataFrame({
+        "名前": ["A", "B"],
+        "image_names": [str(["a1"]), str(["b1"])],
+        "deck_order": [str({}), str({})],
+        "version": [1, 1],
+    })
+    fake = FakeDrive(tmp_path, df)
+    monkeypatch.setattr(analysis_db, "get_drive_service", lambda: None)
+    monkeypatch.setattr(analysis_db, "fetch_drive_file", fake.fetch)
+    monkeypatch.setattr(analysis_db, "save_csv_to_cloud", fake.save)
+    return fake
+
+
+# 同じGoogle Driveを見る2つのサーバー（端末）
+@pytest.fixture
+def sessions(drive):
+    return analysis_db.load_players_from_cloud(), analysis_db.load_players_from_cloud()
+
+
+def test_edits_to_different_players_are_merged(drive, sessions):
+    local, other = sessions
+    local.add_deck("A", "a2")
+    other.add_deck("B", "b2")
+    assert analysis_db.sync_players_to_cloud(other) == (True, [])
+
+    assert analysis_db.sync_players_to_cloud(local) == (True, [])
+    remote = drive.players()
+    assert remote.decks("A") == ["a1", "a2"]
+    assert remote.decks("B") == ["b1", "b2"]
+    assert remote.get("A")["version"] == 2
+    assert remote.get("B")["version"] == 2
+    assert local.dirty_players == set()
+
+
+def test_same_player_edited_on_both_sides_is_a_conflict(drive, sessions):
+    local, other = sessions
+    other.add_deck("A", "from_other")
+    analysis_db.sync_players_to_cloud(other)
+    local.add_deck("A", "from_local")
+
+    uploaded, conflicts = analysis_db.sync_players_to_cloud(local)
+    assert conflicts == ["A"]
+    # Google Driveの内容を優先する
+    assert local.decks("A") == ["a1", "from_other"]
+    assert drive.players().decks("A") == ["a1", "from_other"]
+    assert "A" not in local.dirty_players
+
+
+def test_remote_delete_of_locally_edited_player_is_a_conflict(drive, sessions):
+    local, other = sessions
+    other.remove_player("A")
+    analysis_db.sync_players_to_cloud(other)
+    local.add_deck("A", "a2")
+
+    uploaded, conflicts = analysis_db.sync_players_to_cloud(local)
+    assert conflicts == ["A"]
+    assert "A" not in local
+    assert drive.players().names() == ["B"]
+
+
+def test_locally_added_player_survives_the_merge(drive, sessions):
+    local, other = sessions
+    other.add_deck("B", "b2")
+    analysis_db.sync_players_to_cloud(other)
+    local.add_player("C")
+    local.add_deck("C", "c1")
+
+    assert analysis_db.sync_players_to_cloud(local) == (True, [])
+    remote = drive.players()
+    assert remote.decks("C") == ["c1"]
+    assert remote.decks("B") == ["b1", "b2"]
+    assert local.decks("B") == ["b1", "b2"]
+
+
+def test_failed_upload_keeps_changes_unsynced(drive, sessions):
+    local, _ = sessions
+    local.add_deck("A", "a2")
+    local.add_player("C")
+    drive.fail = True
+    with pytest.raises(OSError):
+        analysis_db.sync_players_to_cloud(local)
+
+    assert local.dirty_players == {"A", "C"}
+    assert local.get("A")["version"] == 1
+    assert local.get("C")["version"] == 0
+    assert local.base_versions == {"A": 1, "B": 1}
+
+    drive.fail = False
+    assert analysis_db.sync_players_to_cloud(local) == (True, [])
+    assert drive.players().get("A")["version"] == 2
+    assert drive.players().decks("A") == ["a1", "a2"]
+
+
+def test_unchanged_content_is_not_uploaded(drive, sessions):
+    local, _ = sessions
+    assert analysis_db.sync_players_to_cloud(local) == (False, [])
+    assert drive.uploads == 0
+
+
+def test_reload_keeps_unsynced_changes_of_other_players(drive, sessions):
+    local, other = sessions
+    local.add_deck("A", "a2")
+    other.add_deck("B", "b2")
+    analysis_db.sync_players_to_cloud(other)
+
+    assert analysis_db.reload_players_from_cloud(local) == []
+    assert local.decks("A") == ["a1", "a2"]
+    assert local.decks("B") == ["b1", "b2"]
+    assert local.dirty_players == {"A"}
+
+
+def test_import_marks_changed_and_dropped_players(drive, sessions):
+    local, _ = sessions
+    uploaded = PlayerStore.from_df(pd.DataFrame({
+        "名前": ["A", "C"],
+        "image_names": [str(["a1"]), str(["c1"])],
+        "deck_order": [str({}), str({})],
+        "version": [9, 9],
+    }))
+    assert local.import_players(uploaded) == (["C"], ["B"])
+    assert local.dirty_players == {"B", "C"}
+    assert local.get("A")["version"] == 1
+
+    assert analysis_db.sync_players_to_cloud(local) == (True, [])
+    assert drive.players().names() == ["A", "C"]